@@ -0,0 +1,50 @@
+"""Per-request cost of token validation with and without the verified-token cache.
+
+Usage: python -m benchmarks.auth_overhead [iterations]
+
+No Redis needed.
+"""
+
+import json
+import sys
+import time
+
+from dependencies.auth import (
+    create_token,
+    get_current_user,
+    token_cache,
+    token_cache_stats,
+)
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+
+def measure(clear_cache: bool) -> float:
+    header = f"Bearer {create_token('bench')}"
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        if clear_cache:
+            token_cache.clear()
+        get_current_user(header)
+    return (time.perf_counter() - start) / ITERATIONS * 1_000_000
+
+
+def main():
+    uncached = measure(clear_cache=True)
+    token_cache_stats.update(hits=0, misses=0)
+    cached = measure(clear_cache=False)
+    print(
+        json.dumps(
+            {
+                "iterations": ITERATIONS,
+                "uncached_us_per_request": round(uncached, 2),
+                "cached_us_per_request": round(cached, 2),
+                "cache_stats": token_cache_stats,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Event-loop latency during a login storm: inline bcrypt vs the worker pool.
+
+Usage: python -m benchmarks.login_latency [logins]
+
+A 10 ms ticker stands in for websocket broadcasts; its lateness is the delay
+every socket on the worker would see while logins are being verified.
+No Redis needed.
+"""
+
+import asyncio
+import json
+import statistics
+import sys
+
+import bcrypt
+
+from services.password_hashing import check_password, hash_stats
+
+LOGINS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+TICK = 0.01
+
+
+async def ticker(lateness: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + TICK
+        await asyncio.sleep(TICK)
+        lateness.append(max(0.0, loop.time() - expected) * 1000)
+
+
+async def check_inline(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+async def measure(check, hashed: str) -> dict:
+    lateness: list[float] = []
+    stop = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lateness, stop))
+    await asyncio.sleep(0.1)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await asyncio.gather(*(check("secret", hashed) for _ in range(LOGINS)))
+    elapsed = loop.time() - start
+    stop.set()
+    await tick_task
+    lateness.sort()
+    return {
+        "logins_per_sec": round(LOGINS / elapsed, 1),
+        "tick_lateness_p50_ms": round(statistics.median(lateness), 2),
+        "tick_lateness_p99_ms": round(lateness[int(len(lateness) * 0.99) - 1], 2),
+        "tick_lateness_max_ms": round(lateness[-1], 2),
+    }
+
+
+async def main():
+    hashed = bcrypt.hashpw(b"secret", bcrypt.gensalt()).decode("utf-8")
+    results = {
+        "logins": LOGINS,
+        "inline": await measure(check_inline, hashed),
+        "offloaded": await measure(check_password, hashed),
+        "pool_stats": hash_stats,
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+"""Per-event latency of publish_room_event: sequential commands vs one pipeline.
+
+Usage: REDIS_URL=redis://localhost:6379/0 python -m benchmarks.publish_latency
+"""
+
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+from helpers.keys import k_event_channel, k_history, k_stats
+from services.redis_setup import redis_client
+from services.websocket_pubsub import iso_now, publish_room_event
+
+ROOM_ID = "BENCH-PUBLISH"
+EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+async def publish_sequential(room_id: str, event: dict, history_max: int = 100):
+    payload = json.dumps(event)
+    await redis_client.publish(k_event_channel(room_id), payload)
+    await redis_client.lpush(k_history(room_id), payload)
+    await redis_client.ltrim(k_history(room_id), 0, history_max - 1)
+    await redis_client.hincrby(k_stats(room_id), "message_sent", 1)
+
+
+async def measure(publish) -> dict:
+    samples = []
+    for i in range(EVENTS):
+        event = {"type": "chat", "username": "bench", "message": str(i)}
+        event["timestamp"] = iso_now()
+        start = time.perf_counter()
+        await publish(ROOM_ID, event)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 4),
+        "p99_ms": round(samples[int(len(samples) * 0.99) - 1], 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+    }
+
+
+async def main():
+    results = {
+        "events": EVENTS,
+        "sequential": await measure(publish_sequential),
+        "pipelined": await measure(publish_room_event),
+    }
+    await redis_client.delete(k_history(ROOM_ID), k_stats(ROOM_ID))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""Subscriber connections and memory: one pubsub per room vs the shared manager.
+
+Usage: REDIS_URL=redis://localhost:6379/0 python -m benchmarks.pubsub_connections
+       [rooms ...] [--skip-legacy]
+
+The legacy mode opens one connection per room, so raise `ulimit -n` (and Redis
+`maxclients`) before running it at 10k rooms.
+"""
+
+import asyncio
+import json
+import sys
+import tracemalloc
+
+from helpers.keys import k_event_channel
+from services.redis_setup import create_redis_client, redis_client
+from services.websocket_pubsub import pubsub_readers, subscribe_room, unsubscribe_room
+
+
+async def pubsub_client_count() -> int:
+    return len(await redis_client.client_list(_type="pubsub"))
+
+
+async def legacy(rooms: int) -> dict:
+    async def worker(pubsub):
+        async for _ in pubsub.listen():
+            pass
+
+    client = create_redis_client(rooms + 10, socket_timeout=None, cluster=False)
+    baseline = await pubsub_client_count()
+    tracemalloc.start()
+    pubsubs, tasks = [], []
+    for i in range(rooms):
+        pubsub = client.pubsub()
+        await pubsub.subscribe(k_event_channel(f"BENCH{i}"))
+        pubsubs.append(pubsub)
+        tasks.append(asyncio.create_task(worker(pubsub)))
+    await asyncio.sleep(0)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {
+        "connections": await pubsub_client_count() - baseline,
+        "reader_tasks": len(tasks),
+        "memory_kb": memory // 1024,
+    }
+    for task in tasks:
+        task.cancel()
+    for pubsub in pubsubs:
+        await pubsub.aclose()
+    await client.aclose()
+    return result
+
+
+async def shared(rooms: int) -> dict:
+    baseline = await pubsub_client_count()
+    tracemalloc.start()
+    for i in range(rooms):
+        await subscribe_room(f"BENCH{i}")
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {
+        "connections": await pubsub_client_count() - baseline,
+        "reader_tasks": len(pubsub_readers),
+        "memory_kb": memory // 1024,
+    }
+    for i in range(rooms):
+        await unsubscribe_room(f"BENCH{i}")
+    return result
+
+
+async def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    sizes = [int(a) for a in args] or [1000, 10000]
+    results = []
+    for rooms in sizes:
+        row = {"rooms": rooms, "shared": await shared(rooms)}
+        if "--skip-legacy" not in sys.argv:
+            row["per_room"] = await legacy(rooms)
+        results.append(row)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""Room creation throughput at high keyspace occupancy.
+
+Usage: REDIS_URL=redis://localhost:6379/15 python -m benchmarks.room_creation
+
+Uses 3-letter room ids (17,576 possible) so the keyspace can be filled to a
+given occupancy before measuring. Run it against a scratch database: it
+FLUSHDBs between rounds.
+"""
+
+import asyncio
+import json
+import random
+import string
+import time
+
+from helpers.keys import ROOMS_ALL, k_members, k_meta, k_user_rooms
+from services.redis_scripts import create_room_record, load_scripts
+from services.redis_setup import redis_client
+from services.websocket_pubsub import iso_now
+
+ID_LENGTH = 3
+OCCUPANCIES = [0.0, 0.5, 0.9]
+CREATES = 500
+
+
+async def create_room_legacy(owner: str, created_at: str) -> str:
+    while True:
+        room_id = "".join(random.choices(string.ascii_uppercase, k=ID_LENGTH))
+        if not await redis_client.exists(k_meta(room_id)):
+            break
+    await redis_client.hset(
+        k_meta(room_id), mapping={"owner": owner, "created_at": created_at}
+    )
+    await redis_client.sadd(k_members(room_id), owner)
+    await redis_client.sadd(k_user_rooms(owner), room_id)
+    await redis_client.sadd(ROOMS_ALL, room_id)
+    return room_id
+
+
+async def prefill(occupancy: float):
+    await redis_client.flushdb()
+    space = ["".join(p) for p in _all_ids()]
+    taken = random.sample(space, int(len(space) * occupancy))
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for room_id in taken:
+            pipe.hset(k_meta(room_id), "owner", "bench")
+            pipe.sadd(ROOMS_ALL, room_id)
+        await pipe.execute()
+
+
+def _all_ids():
+    letters = string.ascii_uppercase
+    return ((a, b, c) for a in letters for b in letters for c in letters)
+
+
+async def measure(create, occupancy: float) -> dict:
+    await prefill(occupancy)
+    failures = 0
+    start = time.perf_counter()
+    for _ in range(CREATES):
+        try:
+            await create("bench", iso_now())
+        except RuntimeError:
+            failures += 1
+    elapsed = time.perf_counter() - start
+    return {
+        "rooms_per_sec": round(CREATES / elapsed, 1),
+        "failures": failures,
+    }
+
+
+async def main():
+    await load_scripts()
+
+    async def create_atomic(owner: str, created_at: str) -> str:
+        return await create_room_record(owner, created_at, length=ID_LENGTH)
+
+    results = []
+    for occupancy in OCCUPANCIES:
+        results.append(
+            {
+                "occupancy": occupancy,
+                "legacy": await measure(create_room_legacy, occupancy),
+                "atomic": await measure(create_atomic, occupancy),
+            }
+        )
+    await redis_client.flushdb()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+"""Encode/decode cost per event: stdlib json vs services.serialization.
+
+Usage: python -m benchmarks.serialization [iterations]
+
+"relay" is what /ws/leaderboard used to do for every pub/sub message
+(decode, then re-encode for send_json); it now forwards the bytes untouched.
+"""
+
+import json
+import sys
+import time
+
+from benchmarks.wire_format import sample_events
+from services.serialization import dumps, loads, orjson
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+
+def per_call_us(func, arg) -> float:
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        func(arg)
+    return round((time.perf_counter() - start) / ITERATIONS * 1e6, 3)
+
+
+def stdlib_relay(payload: str) -> str:
+    return json.dumps(json.loads(payload))
+
+
+def main():
+    results = {"iterations": ITERATIONS, "orjson": orjson is not None, "events": {}}
+    for name, event in sample_events().items():
+        payload = dumps(event)
+        results["events"][name] = {
+            "encode_us": {
+                "stdlib": per_call_us(json.dumps, event),
+                "fast": per_call_us(dumps, event),
+            },
+            "decode_us": {
+                "stdlib": per_call_us(json.loads, payload),
+                "fast": per_call_us(loads, payload),
+            },
+            "relay_us": {
+                "stdlib": per_call_us(stdlib_relay, payload),
+                "passthrough": 0.0,
+            },
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
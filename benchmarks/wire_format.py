@@ -0,0 +1,98 @@
+"""Bytes on the wire per event: JSON text frames vs the msgpack subprotocol.
+
+Usage: python -m benchmarks.wire_format [clients]
+
+Each frame is also deflated on its own (raw deflate, no context takeover),
+which is what permessage-deflate costs at minimum. The encode timings compare
+encoding once per broadcast with encoding once per connected client.
+"""
+
+import json
+import sys
+import time
+import zlib
+
+from services.wire_format import JSON, MSGPACK, encode_frame
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+TIMESTAMP = "2025-01-01T12:00:00.000000+00:00"
+
+
+def sample_events() -> dict:
+    rows = [
+        {"username": f"user{i:03d}", "score": 1000 - i * 7, "rank": i + 1}
+        for i in range(50)
+    ]
+    return {
+        "chat": {
+            "type": "chat",
+            "username": "alice",
+            "message": "anyone stuck on p3?",
+            "timestamp": TIMESTAMP,
+        },
+        "submission": {
+            "type": "submission",
+            "username": "alice",
+            "problem_id": "p3",
+            "points": 20,
+            "new_score": 140.0,
+            "bonus_awarded": True,
+            "rank": 4,
+            "timestamp": TIMESTAMP,
+        },
+        "scoreboard_delta": {
+            "type": "system",
+            "action": "scoreboard_delta",
+            "changes": rows[:5],
+            "removed": [],
+            "timestamp": TIMESTAMP,
+        },
+        "scoreboard_update": {
+            "type": "system",
+            "action": "scoreboard_update",
+            "leaderboard": rows,
+            "timestamp": TIMESTAMP,
+        },
+    }
+
+
+def deflated_size(frame) -> int:
+    data = frame.encode() if isinstance(frame, str) else frame
+    compressor = zlib.compressobj(wbits=-15)
+    return len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def frame_size(frame) -> int:
+    return len(frame.encode()) if isinstance(frame, str) else len(frame)
+
+
+def encode_ms(payload: str, wire_format: str, times: int) -> float:
+    start = time.perf_counter()
+    for _ in range(times):
+        encode_frame(payload, wire_format)
+    return round((time.perf_counter() - start) * 1000, 3)
+
+
+def main():
+    results = {"clients": CLIENTS, "events": {}}
+    for name, event in sample_events().items():
+        payload = json.dumps(event)
+        row = {}
+        for wire_format in (JSON, MSGPACK):
+            frame = encode_frame(payload, wire_format)
+            row[wire_format] = {
+                "bytes": frame_size(frame),
+                "deflated_bytes": deflated_size(frame),
+                "encode_once_ms": encode_ms(payload, wire_format, 1),
+                "encode_per_client_ms": encode_ms(payload, wire_format, CLIENTS),
+            }
+        row["msgpack_saving"] = round(1 - row[MSGPACK]["bytes"] / row[JSON]["bytes"], 3)
+        row["msgpack_deflated_saving"] = round(
+            1 - row[MSGPACK]["deflated_bytes"] / row[JSON]["bytes"], 3
+        )
+        results["events"][name] = row
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""End-to-end websocket load test: N rooms x M clients sending chat and submissions.
+
+Usage: REDIS_URL=redis://localhost:6379/15 python -m benchmarks.ws_load
+       [--rooms 10] [--clients 20] [--messages 50] [--rate 20] [--fake]
+
+The app runs in this process (lifespan included) and clients talk to it over
+ASGI directly, so the numbers cover the app and Redis but not the network or
+a server's websocket framing. --fake swaps Redis for an in-process fakeredis
+server, which is handy for comparing code paths but not for absolute numbers.
+Rate limits are off unless RATE_LIMIT_* is set. Prints one JSON document, so
+runs can be diffed over time.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import tracemalloc
+import uuid
+from urllib.parse import urlencode
+
+command_count = [0]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=20, help="messages/sec/client")
+    parser.add_argument("--fake", action="store_true")
+    return parser.parse_args()
+
+
+def use_fake_redis():
+    import fakeredis
+    import redis.asyncio as redis
+    from fakeredis.aioredis import FakeConnection
+
+    server = fakeredis.FakeServer()
+
+    def from_url(url, **kwargs):
+        return redis.BlockingConnectionPool(
+            connection_class=FakeConnection,
+            server=server,
+            decode_responses=True,
+            max_connections=kwargs.get("max_connections", 100),
+        )
+
+    redis.BlockingConnectionPool.from_url = from_url
+
+
+def count_redis_commands():
+    # Client-side count, so it works against any server and only sees this
+    # process: one per plain command, one per queued pipeline command.
+    from redis.asyncio.client import Pipeline, Redis
+
+    execute_command = Redis.execute_command
+    execute_pipeline = Pipeline.execute
+
+    async def counted_command(self, *args, **kwargs):
+        command_count[0] += 1
+        return await execute_command(self, *args, **kwargs)
+
+    async def counted_pipeline(self, *args, **kwargs):
+        command_count[0] += len(self.command_stack)
+        return await execute_pipeline(self, *args, **kwargs)
+
+    Redis.execute_command = counted_command
+    Pipeline.execute = counted_pipeline
+
+
+class AsgiClient:
+    # Just enough of the ASGI websocket protocol to drive /ws/{room_id}.
+    def __init__(self, app, room_id: str, username: str, token: str):
+        query = urlencode({"username": username, "token": token})
+        self.scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": f"/ws/{room_id}",
+            "raw_path": f"/ws/{room_id}".encode(),
+            "root_path": "",
+            "query_string": query.encode(),
+            "headers": [(b"host", b"bench")],
+            "subprotocols": [],
+            "client": ("bench", 0),
+            "server": ("bench", 80),
+        }
+        self.app = app
+        self.inbound: asyncio.Queue = asyncio.Queue()
+        self.outbound: asyncio.Queue = asyncio.Queue()
+        self.task = None
+
+    async def connect(self):
+        self.task = asyncio.create_task(
+            self.app(self.scope, self.inbound.get, self.outbound.put)
+        )
+        await self.inbound.put({"type": "websocket.connect"})
+        message = await self.outbound.get()
+        if message["type"] != "websocket.accept":
+            raise RuntimeError(f"connection refused: {message}")
+
+    async def send(self, event: dict):
+        await self.inbound.put({"type": "websocket.receive", "text": json.dumps(event)})
+
+    async def receive(self):
+        message = await self.outbound.get()
+        if message["type"] == "websocket.close":
+            return None
+        return message.get("text") or message.get("bytes")
+
+    async def close(self):
+        await self.inbound.put({"type": "websocket.disconnect", "code": 1000})
+        try:
+            await asyncio.wait_for(self.task, 5)
+        except (asyncio.TimeoutError, Exception):
+            self.task.cancel()
+
+
+async def run(args) -> dict:
+    import main
+    from dependencies.auth import create_token
+    from services.send_queue import send_stats
+
+    app = main.app
+    run_id = uuid.uuid4().hex[:6].upper()
+    sent_at: dict[str, float] = {}
+    latencies: list[float] = []
+    received = [0]
+
+    async def reader(client: AsgiClient):
+        while True:
+            frame = await client.receive()
+            if frame is None:
+                return
+            received[0] += 1
+            event = json.loads(frame)
+            if event.get("type") == "submission":
+                started = sent_at.get(event.get("problem_id"))
+                if started is not None:
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+    async def sender(client: AsgiClient, name: str):
+        for i in range(args.messages):
+            if i % 2:
+                problem_id = f"{name}-{i}"
+                sent_at[problem_id] = time.perf_counter()
+                await client.send(
+                    {"type": "submission", "problem_id": problem_id, "points": 1}
+                )
+            else:
+                await client.send({"type": "chat", "message": f"hello {i}"})
+            await asyncio.sleep(1 / args.rate)
+
+    async with app.router.lifespan_context(app):
+        clients = []
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        for r in range(args.rooms):
+            for c in range(args.clients):
+                name = f"bench{r}x{c}"
+                client = AsgiClient(app, f"B{run_id}{r}", name, create_token(name))
+                await client.connect()
+                clients.append((client, name))
+        await asyncio.sleep(0.5)
+        after, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        readers = [asyncio.create_task(reader(client)) for client, _ in clients]
+        received[0] = 0
+        commands_before = command_count[0]
+        start = time.perf_counter()
+        await asyncio.gather(*(sender(client, name) for client, name in clients))
+        submissions = len(sent_at)
+        expected = submissions * args.clients
+        deadline = time.monotonic() + 10
+        while len(latencies) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        commands = command_count[0] - commands_before
+
+        for client, _ in clients:
+            await client.close()
+        for task in readers:
+            task.cancel()
+
+    events = len(clients) * args.messages
+    latencies.sort()
+    return {
+        "backend": "fakeredis" if args.fake else "redis",
+        "rooms": args.rooms,
+        "clients_per_room": args.clients,
+        "messages_per_client": args.messages,
+        "events_sent": events,
+        "frames_delivered": received[0],
+        "submission_deliveries": {"expected": expected, "observed": len(latencies)},
+        "elapsed_s": round(elapsed, 3),
+        "events_per_sec": round(events / elapsed, 1),
+        "frames_per_sec": round(received[0] / elapsed, 1),
+        "broadcast_latency_ms": {
+            "p50": round(statistics.median(latencies), 3) if latencies else None,
+            "p99": (
+                round(latencies[int(len(latencies) * 0.99) - 1], 3)
+                if latencies
+                else None
+            ),
+            "max": round(latencies[-1], 3) if latencies else None,
+        },
+        "redis_commands_per_event": round(commands / events, 2),
+        "memory_per_connection_kb": round((after - before) / len(clients) / 1024, 2),
+        "send_stats": dict(send_stats),
+    }
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("RATE_LIMIT_USER_RATE", "0")
+    os.environ.setdefault("RATE_LIMIT_ROOM_RATE", "0")
+    if args.fake:
+        use_fake_redis()
+    count_redis_commands()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,29 @@
+import asyncio
+import hashlib
 import os
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-import bcrypt
 import jwt
 from fastapi import Depends, HTTPException, WebSocket, WebSocketException, status
 from fastapi.security import APIKeyHeader
 
+from helpers.keys import k_user
+from services.metrics import count_auth_failure
+from services.password_hashing import check_password, hash_password
 from services.redis_setup import redis_client
 
 JWT_SECRET = os.getenv("JWT_SECRET", "Zealous")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 JWT_EXPIRY_MINUTES = int(os.getenv("JWT_EXPIRY_MINUTES", "60"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+# sha256(token) -> (username, expires_at)
+token_cache: "OrderedDict[bytes, tuple[str, float]]" = OrderedDict()
+token_cache_stats = {"hits": 0, "misses": 0}
 
 # oauth2_scheme = OAuth2PasswordBearer(tokenUrl='auth/login')
 api_key_scheme = APIKeyHeader(name="Authorization")
@@ -19,19 +31,19 @@ api_key_scheme = APIKeyHeader(name="Authorization")
 
 async def register_user(username: str, password: str) -> str:
     try:
-        user_exists = await redis_client.exists(f"user:{username}")
+        user_exists = await redis_client.exists(k_user(username))
         if user_exists:
             print(f"User '{username}' already exists.")
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail="Username already exists",
             )
-        hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+        hashed_password = await hash_password(password)
 
         await redis_client.hset(
-            f"user:{username}",
+            k_user(username),
             mapping={
-                "hashed_password": hashed_password.decode("utf-8"),
+                "hashed_password": hashed_password,
             },
         )
 
@@ -44,6 +56,11 @@ async def register_user(username: str, password: str) -> str:
         }
     except HTTPException:
         raise
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent logins, try again shortly",
+        )
     except Exception as e:
         print(f"An error occurred during registration: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=e)
@@ -51,9 +68,10 @@ async def register_user(username: str, password: str) -> str:
 
 async def login_user(username=str, password=str) -> dict:
     try:
-        user_data = await redis_client.hgetall(f"user:{username}")
+        user_data = await redis_client.hgetall(k_user(username))
 
         if not user_data:
+            count_auth_failure("unknown_user")
             print(f"User '{username}' does not exist.")
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -65,12 +83,11 @@ async def login_user(username=str, password=str) -> dict:
             print(f"User '{username}' has no stored password hash.")
             return False
 
-        if bcrypt.checkpw(
-            password.encode("utf-8"), stored_password_hash.encode("utf-8")
-        ):
+        if await check_password(password, stored_password_hash):
             token = create_token(username)
             return {"access_token": token, "token_type": "bearer"}
         else:
+            count_auth_failure("bad_password")
             print(f"Invalid password for user '{username}'.")
             raise HTTPException(
                 status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
@@ -78,6 +95,11 @@ async def login_user(username=str, password=str) -> dict:
             )
     except HTTPException:
         raise
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent logins, try again shortly",
+        )
     except Exception as e:
         print(f"An error occurred during registration: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=e)
@@ -90,32 +112,57 @@ def create_token(username: str) -> str:
 
 
 def validate_token(token: str) -> str:
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    cached = token_cache.get(digest)
+    if cached is not None:
+        username, expires_at = cached
+        if expires_at > time.time():
+            token_cache.move_to_end(digest)
+            token_cache_stats["hits"] += 1
+            return username
+        token_cache.pop(digest, None)
+    token_cache_stats["misses"] += 1
+
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         username: Optional[str] = payload.get("sub")
         if not username:
+            count_auth_failure("invalid_token")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid authentication credentials",
             )
-        return username
     except jwt.ExpiredSignatureError:
+        count_auth_failure("expired_token")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has expired"
         )
     except jwt.InvalidTokenError:
+        count_auth_failure("invalid_token")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
         )
 
+    # Never keep a token past its own exp, so expiry is enforced exactly as
+    # jwt.decode would.
+    expires_at = time.time() + TOKEN_CACHE_TTL
+    if "exp" in payload:
+        expires_at = min(expires_at, float(payload["exp"]))
+    token_cache[digest] = (username, expires_at)
+    if len(token_cache) > TOKEN_CACHE_SIZE:
+        token_cache.popitem(last=False)
+    return username
+
 
 def extract_bearer(authorization: Optional[str]) -> str:
     if not authorization:
+        count_auth_failure("missing_header")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Authorization header missing",
         )
     if not authorization.lower().startswith("bearer "):
+        count_auth_failure("invalid_header")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authorization header",
@@ -0,0 +1,98 @@
+# Every per-room key wraps the room id in a {hash tag}, so all of a room's keys
+# hash to the same cluster slot and multi-key commands, MULTI and Lua scripts
+# over them work on Redis Cluster.
+
+ROOMS_ALL = "rooms:all"
+NODES_ALL = "nodes:all"
+TRACED_ROOMS = "traces:rooms"
+SLOW_TRACES = "traces:slow"
+
+ROOM_KEY_SUFFIXES = (
+    "meta",
+    "members",
+    "leaderboard",
+    "stats",
+    "presence",
+    "history",
+    "stream",
+    "problems",
+    "ticker",
+)
+
+
+def room_tag(room_id: str) -> str:
+    return f"{{{room_id}}}"
+
+
+def k_room(room_id: str, suffix: str) -> str:
+    return f"room:{room_tag(room_id)}:{suffix}"
+
+
+def k_meta(room_id: str) -> str:
+    return k_room(room_id, "meta")
+
+
+def k_members(room_id: str) -> str:
+    return k_room(room_id, "members")
+
+
+def k_leaderboard(room_id: str) -> str:
+    return k_room(room_id, "leaderboard")
+
+
+def k_stats(room_id: str) -> str:
+    return k_room(room_id, "stats")
+
+
+def k_presence(room_id: str) -> str:
+    return k_room(room_id, "presence")
+
+
+def k_history(room_id: str) -> str:
+    return k_room(room_id, "history")
+
+
+def k_stream(room_id: str) -> str:
+    return k_room(room_id, "stream")
+
+
+def k_problems(room_id: str) -> str:
+    return k_room(room_id, "problems")
+
+
+def k_scoreboard_lease(room_id: str) -> str:
+    return k_room(room_id, "ticker")
+
+
+def k_first_solver(room_id: str, problem_id: str) -> str:
+    return f"problem:{room_tag(room_id)}:{problem_id}:first_solver"
+
+
+def room_keys(room_id: str) -> list[str]:
+    return [k_room(room_id, suffix) for suffix in ROOM_KEY_SUFFIXES]
+
+
+# Pub/sub channels are not slot-bound, so the channel name keeps its original
+# form and nodes on either side of a rolling deploy still hear each other.
+def k_event_channel(room_id: str) -> str:
+    return f"room:{room_id}:events"
+
+
+def k_migration_lock(room_id: str) -> str:
+    return f"migration:{room_tag(room_id)}:lock"
+
+
+def k_rate_limit(scope: str, ident: str) -> str:
+    return f"ratelimit:{scope}:{ident}"
+
+
+def k_node_lease(node_id: str) -> str:
+    return f"node:{node_id}:lease"
+
+
+def k_user(username: str) -> str:
+    return f"user:{username}"
+
+
+def k_user_rooms(username: str) -> str:
+    return f"user:{username}:rooms"
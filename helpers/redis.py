@@ -1,19 +1,85 @@
-import random
-import string
+from typing import Optional
 
+from helpers.keys import k_leaderboard, k_stats, k_user_rooms
 from services.redis_setup import redis_client
 
+# Bumped on every leaderboard write so clients can skip unchanged pages.
+LEADERBOARD_VERSION_FIELD = "leaderboard_version"
+
+
+def public_stats(stats: dict) -> dict:
+    # The stats hash also holds LEADERBOARD_VERSION_FIELD, which is internal.
+    return {k: v for k, v in stats.items() if k != LEADERBOARD_VERSION_FIELD}
+
 
 async def get_leaderboard(room_id: str, top_n: int = 100):
-    key = f"room:{room_id}:leaderboard"
-    raw = await redis_client.zrevrange(key, 0, top_n - 1, withscores=True)
+    raw = await redis_client.zrevrange(
+        k_leaderboard(room_id), 0, top_n - 1, withscores=True
+    )
     return [{"username": user, "score": int(score)} for (user, score) in raw]
 
 
-async def generate_room_id(length: int = 6) -> str:
-    while True:
-        room_id = "".join(random.choices(string.ascii_uppercase, k=length))
+def ranked_rows(raw, first_rank: int) -> list[dict]:
+    return [
+        {"username": user, "score": int(score), "rank": rank}
+        for rank, (user, score) in enumerate(raw, start=first_rank)
+    ]
+
+
+async def get_leaderboard_page(room_id: str, offset: int, limit: int) -> dict:
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zrevrange(
+            k_leaderboard(room_id), offset, offset + limit - 1, withscores=True
+        )
+        pipe.zcard(k_leaderboard(room_id))
+        pipe.hget(k_stats(room_id), LEADERBOARD_VERSION_FIELD)
+        raw, total, version = await pipe.execute()
+    return {
+        "version": int(version or 0),
+        "offset": offset,
+        "limit": limit,
+        "total": total,
+        "leaderboard": ranked_rows(raw, offset + 1),
+    }
+
+
+async def get_user_rank(room_id: str, username: str) -> Optional[dict]:
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zrevrank(k_leaderboard(room_id), username)
+        pipe.zscore(k_leaderboard(room_id), username)
+        pipe.hget(k_stats(room_id), LEADERBOARD_VERSION_FIELD)
+        rank, score, version = await pipe.execute()
+    if rank is None:
+        return None
+    return {
+        "version": int(version or 0),
+        "username": username,
+        "rank": rank + 1,
+        "score": int(score),
+    }
+
+
+async def get_leaderboard_around(
+    room_id: str, username: str, above: int, below: int
+) -> Optional[dict]:
+    me = await get_user_rank(room_id, username)
+    if me is None:
+        return None
+    start = max(me["rank"] - 1 - above, 0)
+    raw = await redis_client.zrevrange(
+        k_leaderboard(room_id), start, me["rank"] - 1 + below, withscores=True
+    )
+    return {
+        "version": me["version"],
+        "username": username,
+        "rank": me["rank"],
+        "score": me["score"],
+        "leaderboard": ranked_rows(raw, start + 1),
+    }
+
 
-        exists = await redis_client.exists(f"room:{room_id}:meta")
-        if not exists:
-            return room_id
+async def unindex_room_members(room_id: str, members):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for member in members:
+            pipe.srem(k_user_rooms(member), room_id)
+        await pipe.execute()
@@ -1,25 +1,81 @@
-from dotenv import load_dotenv
-from fastapi import FastAPI
+import utils.env  # noqa: F401  isort: skip
+import asyncio
+from contextlib import asynccontextmanager
 
-from routers import auth, playground, redis, rooms, websocket
+from fastapi import FastAPI, Response
+
+from routers import auth, debug, metrics, playground, redis, rooms, websocket
+from services.drain import drain_connections, drain_state, is_draining
+from services.metrics import count_error
+from services.node_registry import NODE_ID, deregister_node, node_state, register_node
+from services.presence import presence_worker, release_presence
+from services.read_cache import read_cache_listener
+from services.redis_scripts import load_scripts
+from services.redis_setup import close_redis_clients
+from services.room_lifecycle import room_gc_worker
+from services.scoreboard import scoreboard_listener, stop_scoreboard_tickers
+from services.tracing import trace_worker
+from services.websocket_pubsub import stop_event_readers
 from utils import cors_config, openapi_config
 
-load_dotenv()
 
-app = FastAPI(title="Race Condition Interview Task")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    drain_state["draining"] = False
+    await load_scripts()
+    await register_node()
+    tasks = [
+        asyncio.create_task(room_gc_worker()),
+        asyncio.create_task(read_cache_listener()),
+        asyncio.create_task(presence_worker()),
+        asyncio.create_task(scoreboard_listener()),
+        asyncio.create_task(trace_worker()),
+    ]
+    try:
+        yield
+    finally:
+        # A no-op when the launcher already drained, before the server closed
+        # the sockets itself.
+        await drain_connections()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await stop_scoreboard_tickers()
+        await stop_event_readers()
+        for step in (release_presence, deregister_node):
+            try:
+                await step()
+            except Exception:
+                count_error("shutdown")
+        await close_redis_clients()
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="Race Condition Interview Task", lifespan=lifespan)
+
+    cors_config.setup_cors(app)
 
-cors_config.setup_cors(app)
+    app.include_router(playground.router)
+    app.include_router(websocket.router)
+    app.include_router(redis.router)
+    app.include_router(auth.router)
+    app.include_router(rooms.router)
+    app.include_router(metrics.router)
+    app.include_router(debug.router)
 
-app.include_router(playground.router)
-app.include_router(websocket.router)
-app.include_router(redis.router)
-app.include_router(auth.router)
-app.include_router(rooms.router)
+    @app.get("/")
+    def read_root():
+        return {"message": "Hello!"}
 
+    @app.get("/health")
+    def health(response: Response):
+        # 503 while draining, so load balancers stop routing to this worker.
+        if is_draining():
+            response.status_code = 503
+        return {"node_id": NODE_ID, "status": node_state["status"]}
 
-@app.get("/")
-def read_root():
-    return {"message": "Hello!"}
+    openapi_config.setup_openapi(app)
+    return app
 
 
-openapi_config.setup_openapi(app)
+app = create_app()
@@ -0,0 +1,53 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+
+from dependencies.auth import get_current_user
+from services.node_registry import list_nodes
+from services.tracing import (
+    TRACE_ROOM_TTL_SECONDS,
+    TRACE_SAMPLE_RATE,
+    TRACE_SLOW_MS,
+    recent_traces,
+    trace_room,
+    traced_rooms,
+    untrace_room,
+)
+
+router = APIRouter(prefix="/debug", tags=["Debug"])
+
+# Traces and the per-room switch are kept in Redis, so these endpoints see and
+# change every worker, not just the one serving the request. Other workers pick
+# up a switch within a second.
+
+
+@router.get("/traces")
+async def get_traces(
+    room_id: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000),
+    user=Depends(get_current_user),
+):
+    return {
+        "sample_rate": TRACE_SAMPLE_RATE,
+        "slow_ms": TRACE_SLOW_MS,
+        "traced_rooms": sorted(traced_rooms),
+        "traces": await recent_traces(room_id, limit),
+    }
+
+
+@router.post("/traces/rooms/{room_id}")
+async def start_room_trace(room_id: str, user=Depends(get_current_user)):
+    await trace_room(room_id)
+    return {"room_id": room_id, "tracing": True, "expires_in": TRACE_ROOM_TTL_SECONDS}
+
+
+@router.delete("/traces/rooms/{room_id}")
+async def stop_room_trace(room_id: str, user=Depends(get_current_user)):
+    await untrace_room(room_id)
+    return {"room_id": room_id, "tracing": False}
+
+
+@router.get("/nodes")
+async def get_nodes(user=Depends(get_current_user)):
+    # Every live worker from the Redis registry, not just this one.
+    return {"nodes": await list_nodes()}
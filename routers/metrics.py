@@ -0,0 +1,152 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from dependencies.auth import token_cache_stats
+from services.metrics import (
+    auth_failures,
+    errors,
+    fan_out_seconds,
+    redis_command_seconds,
+    render_histogram,
+    render_metric,
+)
+from services.password_hashing import hash_stats
+from services.rate_limit import rate_limit_stats
+from services.read_cache import read_cache, read_cache_stats
+from services.room_lifecycle import gc_stats
+from services.send_queue import send_stats
+from services.websocket_pubsub import (
+    connected,
+    pubsub_shards,
+    stream_rooms,
+    subscribed_channels,
+)
+
+router = APIRouter(tags=["Metrics"])
+
+
+def counter(name: str, help_text: str, value) -> list[str]:
+    return render_metric(name, "counter", help_text, [({}, value)])
+
+
+def gauge(name: str, help_text: str, value) -> list[str]:
+    return render_metric(name, "gauge", help_text, [({}, value)])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    lines = []
+    lines += render_metric(
+        "ws_connected_sockets",
+        "gauge",
+        "Websockets connected to this worker, per room.",
+        [({"room": room_id}, len(sockets)) for room_id, sockets in connected.items()],
+    )
+    lines += gauge(
+        "pubsub_subscriptions",
+        "Rooms this worker is subscribed to.",
+        len(subscribed_channels) + len(stream_rooms),
+    )
+    lines += gauge(
+        "pubsub_connections", "Shared pub/sub connections open.", len(pubsub_shards)
+    )
+    lines += render_histogram(
+        "redis_command_duration_seconds",
+        "Redis round-trip time per command; pipelines count as PIPELINE.",
+        [({"command": name}, h) for name, h in sorted(redis_command_seconds.items())],
+    )
+    lines += render_histogram(
+        "fan_out_duration_seconds",
+        "Time to enqueue one event for every local socket in a room.",
+        [({}, fan_out_seconds)],
+    )
+    lines += counter(
+        "ws_send_failures_total",
+        "Socket writes that failed.",
+        send_stats["send_failures"],
+    )
+    lines += counter(
+        "ws_messages_dropped_total",
+        "Frames dropped from full send queues.",
+        send_stats["dropped"],
+    )
+    lines += counter(
+        "ws_slow_consumer_disconnects_total",
+        "Sockets closed for falling behind.",
+        send_stats["disconnected"],
+    )
+    lines += render_metric(
+        "auth_failures_total",
+        "counter",
+        "Rejected logins and tokens, by reason.",
+        [({"reason": reason}, n) for reason, n in sorted(auth_failures.items())],
+    )
+    lines += render_metric(
+        "handled_errors_total",
+        "counter",
+        "Exceptions caught and survived, by location.",
+        [({"where": where}, n) for where, n in sorted(errors.items())],
+    )
+    lines += render_metric(
+        "token_cache_lookups_total",
+        "counter",
+        "Verified-token cache lookups.",
+        [({"result": "hit"}, token_cache_stats["hits"])]
+        + [({"result": "miss"}, token_cache_stats["misses"])],
+    )
+    lines += render_metric(
+        "read_cache_lookups_total",
+        "counter",
+        "Leaderboard/stats read cache lookups.",
+        [({"result": "hit"}, read_cache_stats["hits"])]
+        + [({"result": "miss"}, read_cache_stats["misses"])],
+    )
+    lines += counter(
+        "read_cache_evictions_total",
+        "Rooms evicted from the read cache for space.",
+        read_cache_stats["evictions"],
+    )
+    lines += counter(
+        "read_cache_invalidations_total",
+        "Rooms evicted from the read cache by a write.",
+        read_cache_stats["invalidations"],
+    )
+    lines += gauge("read_cache_rooms", "Rooms in the read cache.", len(read_cache))
+    lines += gauge(
+        "bcrypt_queued", "bcrypt calls waiting for a slot.", hash_stats["queued"]
+    )
+    lines += gauge("bcrypt_in_flight", "bcrypt calls running.", hash_stats["in_flight"])
+    lines += counter(
+        "bcrypt_completed_total", "bcrypt calls finished.", hash_stats["completed"]
+    )
+    lines += counter(
+        "bcrypt_timeouts_total",
+        "bcrypt calls that gave up waiting for a slot.",
+        hash_stats["timeouts"],
+    )
+    lines += counter(
+        "rate_limit_allowed_total",
+        "Websocket messages let through.",
+        rate_limit_stats["allowed"],
+    )
+    lines += render_metric(
+        "rate_limit_throttled_total",
+        "counter",
+        "Websocket messages rejected, by bucket.",
+        [({"scope": "user"}, rate_limit_stats["throttled_user"])]
+        + [({"scope": "room"}, rate_limit_stats["throttled_room"])],
+    )
+    lines += counter("room_gc_sweeps_total", "Room GC sweeps run.", gc_stats["sweeps"])
+    lines += counter(
+        "room_gc_rooms_reclaimed_total",
+        "Rooms removed by the GC.",
+        gc_stats["rooms_reclaimed"],
+    )
+    lines += counter(
+        "room_gc_keys_reclaimed_total",
+        "Keys removed by the GC.",
+        gc_stats["keys_reclaimed"],
+    )
+    return PlainTextResponse(
+        "\n".join(lines) + "\n", media_type="text/plain; version=0.0.4"
+    )
@@ -1,10 +1,16 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Query, Request, Response
 
+from helpers.keys import k_leaderboard, k_stats
+from helpers.redis import LEADERBOARD_VERSION_FIELD, get_leaderboard_page
+from services.read_cache import cached_read, etag_response, queue_cache_invalidation
 from services.redis_setup import redis_client
+from services.room_lifecycle import touch_room
+from services.serialization import FastJSONResponse
 
 router = APIRouter(
     prefix="/playground",
     tags=["Playground"],
+    default_response_class=FastJSONResponse,
 )
 
 room_id = "OPD-5"
@@ -18,16 +24,27 @@ async def redisPing():
 
 @router.post("/submit/{username}/{points}")
 async def submitScore(username: str, points: int):
-    new_score = await redis_client.zincrby(
-        f"room:{room_id}:leaderboard", points, username
-    )
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zincrby(k_leaderboard(room_id), points, username)
+        pipe.hincrby(k_stats(room_id), LEADERBOARD_VERSION_FIELD, 1)
+        queue_cache_invalidation(pipe, room_id)
+        new_score, *_ = await pipe.execute()
+    await touch_room(room_id)
     return {"username": username, "new_score": new_score}
 
 
 @router.get("/leaderboard")
-async def getLeaderboard():
-    scores = await redis_client.zrevrange(
-        f"room:{room_id}:leaderboard", 0, -1, withscores=True
-    )
-    leaderboard = [{"username": user, "score": int(score)} for user, score in scores]
-    return {"room_id": room_id, "leaderboard": leaderboard}
+async def getLeaderboard(
+    request: Request,
+    response: Response,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    async def load():
+        return {
+            "room_id": room_id,
+            **await get_leaderboard_page(room_id, offset, limit),
+        }
+
+    body, etag = await cached_read(room_id, f"leaderboard:{offset}:{limit}", load)
+    return etag_response(request, response, body, etag)
@@ -1,25 +1,29 @@
-import json
-
 from fastapi import APIRouter
 
+from helpers.keys import k_leaderboard, k_stats
+from helpers.redis import LEADERBOARD_VERSION_FIELD
+from services.read_cache import queue_cache_invalidation
 from services.redis_setup import redis_client
+from services.scoreboard import SCOREBOARD_TOP_N
+from services.serialization import FastJSONResponse
+from services.websocket_pubsub import publish_room_event
 
-router = APIRouter(prefix="/redis", tags=["Redis"])
+router = APIRouter(
+    prefix="/redis", tags=["Redis"], default_response_class=FastJSONResponse
+)
 
 room_id = "OPD-5"
 
 
 @router.post("/submit/{username}/{points}")
 async def submitScore(username: str, points: int):
-    new_score = await redis_client.zincrby(
-        f"room:{room_id}:leaderboard", points, username
-    )
-
-    scores = await redis_client.zrevrange(
-        f"room:{room_id}:leaderboard", 0, -1, withscores=True
-    )
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zincrby(k_leaderboard(room_id), points, username)
+        pipe.hincrby(k_stats(room_id), LEADERBOARD_VERSION_FIELD, 1)
+        pipe.zrevrange(k_leaderboard(room_id), 0, SCOREBOARD_TOP_N - 1, withscores=True)
+        queue_cache_invalidation(pipe, room_id)
+        new_score, _, scores, *_ = await pipe.execute()
     leaderboard = [{"username": user, "score": int(score)} for user, score in scores]
 
-    update_message = json.dumps({"room_id": room_id, "leaderboard": leaderboard})
-    await redis_client.publish(f"room:{room_id}:events", update_message)
+    await publish_room_event(room_id, {"room_id": room_id, "leaderboard": leaderboard})
     return {"username": username, "new_score": new_score}
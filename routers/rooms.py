@@ -1,99 +1,198 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 
 from dependencies.auth import get_current_user
-from helpers.redis import generate_room_id
+from helpers.keys import (
+    ROOMS_ALL,
+    k_leaderboard,
+    k_members,
+    k_meta,
+    k_stats,
+    k_user_rooms,
+)
+from helpers.redis import (
+    get_leaderboard_around,
+    get_leaderboard_page,
+    get_user_rank,
+    public_stats,
+    unindex_room_members,
+)
+from services.legacy_keys import migrate_legacy_room_param, migrate_legacy_rooms
+from services.presence import online_users, queue_presence_members
+from services.read_cache import (
+    cached_read,
+    etag_response,
+    read_cache,
+    read_cache_hit_ratio,
+    read_cache_stats,
+)
+from services.redis_scripts import create_room_record
 from services.redis_setup import redis_client
+from services.room_lifecycle import touch_room, unlink_room
+from services.serialization import FastJSONResponse, dumps_bytes
 from services.websocket_pubsub import iso_now
 
 router = APIRouter(
     prefix="/rooms",
     tags=["Rooms"],
+    default_response_class=FastJSONResponse,
+    dependencies=[Depends(migrate_legacy_room_param)],
 )
 
+ADMIN_EXPORT_PAGE_SIZE = 500
+ADMIN_FIELDS = ("meta", "members", "stats", "leaderboard")
+
+
+def parse_admin_fields(fields: Optional[str]) -> list[str]:
+    if not fields:
+        return list(ADMIN_FIELDS)
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in ADMIN_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+            detail=f"Unknown fields: {', '.join(unknown)}",
+        )
+    return selected
+
+
+async def fetch_admin_rooms(room_ids: list[str], fields: list[str]) -> list[dict]:
+    # One pipelined round trip for the whole page.
+    await migrate_legacy_rooms(room_ids)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for room_id in room_ids:
+            for field in fields:
+                if field == "meta":
+                    pipe.hgetall(k_meta(room_id))
+                elif field == "members":
+                    pipe.smembers(k_members(room_id))
+                elif field == "stats":
+                    pipe.hgetall(k_stats(room_id))
+                elif field == "leaderboard":
+                    pipe.zrevrange(k_leaderboard(room_id), 0, -1, withscores=True)
+        results = iter(await pipe.execute())
+
+    rooms = []
+    for room_id in room_ids:
+        room = {"room_id": room_id}
+        for field in fields:
+            value = next(results)
+            if field == "members":
+                value = list(value)
+            elif field == "stats":
+                value = public_stats(value)
+            elif field == "leaderboard":
+                value = [
+                    {"username": username, "score": int(score)}
+                    for username, score in value
+                ]
+            room[field] = value
+        rooms.append(room)
+    return rooms
+
 
 @router.get("/admin")
-async def get_all_rooms_admin(user=Depends(get_current_user)):
+async def get_all_rooms_admin(
+    cursor: int = 0,
+    count: int = Query(100, ge=1, le=1000),
+    fields: Optional[str] = None,
+    user=Depends(get_current_user),
+):
     # if user.get("role") != "admin":
     #     raise HTTPException(status_code=403, detail="Admins only")
-    room_ids = await redis_client.smembers("rooms:all")
-    rooms = []
+    selected = parse_admin_fields(fields)
+    next_cursor, room_ids = await redis_client.sscan(
+        ROOMS_ALL, cursor=cursor, count=count
+    )
+    rooms = await fetch_admin_rooms(list(room_ids), selected)
 
-    for room_id in room_ids:
-        meta = await redis_client.hgetall(f"room:{room_id}:meta")
-        members = await redis_client.smembers(f"room:{room_id}:members")
-        stats = await redis_client.hgetall(f"room:{room_id}:stats")
-        leaderboard_raw = await redis_client.zrevrange(
-            f"room:{room_id}:leaderboard", 0, -1, withscores=True
-        )
-        leaderboard = [
-            {"username": username, "score": int(score)}
-            for username, score in leaderboard_raw
-        ]
-
-        rooms.append(
-            {
-                "room_id": room_id,
-                "meta": meta,
-                "members": list(members),
-                "stats": stats,
-                "leaderboard": leaderboard,
-            }
-        )
+    return {"rooms": rooms, "next_cursor": next_cursor}
 
-    return {"rooms": rooms}
+
+@router.get("/admin/export")
+async def export_all_rooms_admin(
+    fields: Optional[str] = None, user=Depends(get_current_user)
+):
+    selected = parse_admin_fields(fields)
+
+    async def rows():
+        cursor = 0
+        while True:
+            cursor, room_ids = await redis_client.sscan(
+                ROOMS_ALL, cursor=cursor, count=ADMIN_EXPORT_PAGE_SIZE
+            )
+            for room in await fetch_admin_rooms(list(room_ids), selected):
+                yield dumps_bytes(room) + b"\n"
+            if cursor == 0:
+                break
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+
+@router.get("/cache")
+async def get_read_cache_stats():
+    return {
+        **read_cache_stats,
+        "hit_ratio": round(read_cache_hit_ratio(), 4),
+        "rooms": len(read_cache),
+    }
 
 
 @router.get("/")
 async def get_all_rooms(user=Depends(get_current_user)):
     username = user["username"]
-    room_ids = await redis_client.smembers("rooms:all")
-    print(room_ids)
-    rooms = []
+    room_ids = list(await redis_client.smembers(k_user_rooms(username)))
+    # Legacy rooms are moved to their new keys first, so a room is only
+    # pruned from the index when it is really gone.
+    await migrate_legacy_rooms(room_ids)
 
-    for room_id in room_ids:
-        members = await redis_client.smembers(f"room:{room_id}:members")
-        print("Room:", room_id)
-        print("Members raw:", members)
-        print("Current user:", username.encode())
-        if username.encode() not in members:
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for room_id in room_ids:
+            pipe.hgetall(k_meta(room_id))
+            pipe.smembers(k_members(room_id))
+        results = await pipe.execute()
+
+    rooms = []
+    stale = []
+    for i, room_id in enumerate(room_ids):
+        meta, members = results[2 * i], results[2 * i + 1]
+        if not meta or username not in members:
+            stale.append(room_id)
             continue
+        rooms.append({"room_id": room_id, "meta": meta, "members": list(members)})
 
-        meta = await redis_client.hgetall(f"room:{room_id}:meta")
-        rooms.append(
-            {"room_id": room_id, "meta": meta, "members": [m.decode() for m in members]}
-        )
+    if stale:
+        await redis_client.srem(k_user_rooms(username), *stale)
 
     return {"rooms": rooms}
 
 
 @router.post("/create")
 async def create_room(user=Depends(get_current_user)):
-    room_id = await generate_room_id()
-    key = f"room:{room_id}:meta"
-
-    await redis_client.hset(
-        key,
-        mapping={
-            "owner": user["username"],
-            "created_at": iso_now(),
-        },
-    )
-
-    await redis_client.sadd(f"room:{room_id}:members", user["username"])
-    await redis_client.sadd("rooms:all", room_id)
+    try:
+        room_id = await create_room_record(user["username"], iso_now())
+    except RuntimeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        )
+    await touch_room(room_id, force=True)
     return {"room_id": room_id, "owner": user["username"]}
 
 
 @router.post("/join/{room_id}")
 async def join_room(room_id: str, user=Depends(get_current_user)):
     try:
-        exists = await redis_client.exists(f"room:{room_id}:meta")
+        exists = await redis_client.exists(k_meta(room_id))
         if not exists:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Room: '{room_id}' Not found!",
             )
-        await redis_client.sadd(f"room:{room_id}:members", user["username"])
+        await redis_client.sadd(k_members(room_id), user["username"])
+        await redis_client.sadd(k_user_rooms(user["username"]), room_id)
+        await touch_room(room_id)
         return {"message": f"{user['username']} joined room {room_id}"}
 
     except HTTPException:
@@ -108,37 +207,30 @@ async def join_room(room_id: str, user=Depends(get_current_user)):
 async def leave_room(room_id: str, user=Depends(get_current_user)):
     try:
         username = user["username"]
-        exists = await redis_client.exists(f"room:{room_id}:meta")
+        exists = await redis_client.exists(k_meta(room_id))
         if not exists:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="room not found"
             )
-        await redis_client.srem(f"room:{room_id}:members", username)
+        await redis_client.srem(k_members(room_id), username)
+        await redis_client.srem(k_user_rooms(username), room_id)
 
-        members = await redis_client.smembers(f"room:{room_id}:members")
-        members = [m.decode() for m in members]
+        members = list(await redis_client.smembers(k_members(room_id)))
 
-        meta = await redis_client.hgetall(f"room:{room_id}:meta")
+        meta = await redis_client.hgetall(k_meta(room_id))
         owner = meta.get("owner")
 
         if username == owner:
             if members:
                 new_owner = members[-1]
-                await redis_client.hset(f"room:{room_id}:meta", owner, new_owner)
+                await redis_client.hset(k_meta(room_id), owner, new_owner)
                 return {
                     "message": f"{username} left. Ownership transferred to {new_owner}.",
                     "new_owner": new_owner,
                 }
         else:
-            await redis_client.delete(
-                f"room:{room_id}:meta",
-                f"room:{room_id}:members",
-                f"room:{room_id}:leaderboard",
-                f"room:{room_id}:stats",
-                f"room:{room_id}:events",
-                f"room:{room_id}:users",
-                f"room:{room_id}:history",
-            )
+            await unindex_room_members(room_id, members)
+            await unlink_room(room_id)
 
             return {
                 "message": f"{username} left. No members remaining, room {room_id} deleted."
@@ -150,7 +242,7 @@ async def leave_room(room_id: str, user=Depends(get_current_user)):
 
 @router.delete("/{room_id}")
 async def delete_room(room_id: str, user=Depends(get_current_user)):
-    meta = await redis_client.hgetall(f"room:{room_id}:meta")
+    meta = await redis_client.hgetall(k_meta(room_id))
     if not meta:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Room not found"
@@ -163,31 +255,30 @@ async def delete_room(room_id: str, user=Depends(get_current_user)):
             detail="Only owner can delete this room",
         )
 
-    await redis_client.delete(
-        f"room:{room_id}:meta",
-        f"room:{room_id}:members",
-        f"room:{room_id}:leaderboard",
-        f"room:{room_id}:stats",
-        f"room:{room_id}:events",
-        f"room:{room_id}:users",
-        f"room:{room_id}:history",
-    )
-    await redis_client.srem("rooms:all", room_id)
+    members = await redis_client.smembers(k_members(room_id))
+    await unindex_room_members(room_id, members)
+    await unlink_room(room_id)
 
     return {"message": f"Room {room_id} deleted successfully"}
 
 
 @router.get("/{room_id}/leaderboard")
-async def get_leaderboard(room_id: str):
-    try:
-        scores = await redis_client.zrevrange(
-            f"room:{room_id}:leaderboard", 0, -1, withscores=True
-        )
-        leaderboard = [
-            {"username": user, "score": int(score)} for user, score in scores
-        ]
+async def get_leaderboard(
+    room_id: str,
+    request: Request,
+    response: Response,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    async def load():
+        return {
+            "room_id": room_id,
+            **await get_leaderboard_page(room_id, offset, limit),
+        }
 
-        return {"room_id": room_id, "leaderboard": leaderboard}
+    try:
+        body, etag = await cached_read(room_id, f"leaderboard:{offset}:{limit}", load)
+        return etag_response(request, response, body, etag)
 
     except Exception as e:
         raise HTTPException(
@@ -195,21 +286,55 @@ async def get_leaderboard(room_id: str):
         )
 
 
-@router.get("/{room_id}/stats")
-async def get_score(room_id: str):
-    try:
-        stats = await redis_client.hgetall(f"room:{room_id}:stats")
+@router.get("/{room_id}/leaderboard/rank/{username}")
+async def get_leaderboard_rank(room_id: str, username: str):
+    entry = await get_user_rank(room_id, username)
+    if entry is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"'{username}' is not on the leaderboard",
+        )
+    return {"room_id": room_id, **entry}
+
+
+@router.get("/{room_id}/leaderboard/around/{username}")
+async def get_leaderboard_around_user(
+    room_id: str,
+    username: str,
+    above: int = Query(5, ge=0, le=100),
+    below: int = Query(5, ge=0, le=100),
+):
+    window = await get_leaderboard_around(room_id, username, above, below)
+    if window is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"'{username}' is not on the leaderboard",
+        )
+    return {"room_id": room_id, **window}
+
 
-        stats = {k: int(v) for k, v in stats.items()}
+@router.get("/{room_id}/stats")
+async def get_score(room_id: str, request: Request, response: Response):
+    async def load():
+        # One round trip for both; node leases come from a short local cache.
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(k_stats(room_id))
+            queue_presence_members(pipe, room_id)
+            stats, members = await pipe.execute()
+        users = await online_users(members)
 
-        active_users = await redis_client.scard(f"room:{room_id}:users")
+        stats = {k: int(v) for k, v in public_stats(stats).items()}
 
         return {
             "room_id": room_id,
-            "active_users": active_users,
+            "active_users": len(users),
             **stats,
         }
 
+    try:
+        body, etag = await cached_read(room_id, "stats", load)
+        return etag_response(request, response, body, etag)
+
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
@@ -1,5 +1,6 @@
 import asyncio
-import json
+import os
+from typing import Optional
 
 from fastapi import (
     APIRouter,
@@ -10,30 +11,243 @@ from fastapi import (
 )
 
 from dependencies.auth import get_user_from_websocket
-from helpers.redis import get_leaderboard
+from helpers.keys import k_event_channel
+from services.drain import is_draining
+from services.legacy_keys import migrate_legacy_rooms
+from services.metrics import count_auth_failure, count_error
+from services.presence import presence_join, presence_leave
+from services.rate_limit import RATE_LIMIT_BACKEND, allow_message, rate_limit_stats
+from services.redis_scripts import score_submission, score_submissions
+from services.redis_setup import pubsub_client
+from services.scoreboard import (
+    mark_scoreboard_dirty,
+    request_scoreboard_keyframe,
+    scoreboard_tasks,
+    scoreboard_ticker,
+)
+from services.tracing import set_trace_kind, span, traced
 from services.websocket_pubsub import (
     connected,
     iso_now,
-    k_users,
     publish_room_event,
-    pubsub_tasks,
-    redis_client,
-    room_pubsub_worker,
+    register_client,
+    replay_room_events,
+    subscribe_room,
+    unregister_client,
+    unsubscribe_room,
 )
+from services.wire_format import JSON, decode_frame, negotiate_format, send_message
 
 router = APIRouter(prefix="/ws", tags=["Websocket"])
 
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+
+def parse_submission(msg: dict) -> Optional[tuple[str, int]]:
+    # (problem_id, points), or None when either is missing or not usable.
+    problem_id = msg.get("problem_id")
+    try:
+        points = int(msg.get("points", 0))
+    except (TypeError, ValueError):
+        return None
+    if not problem_id or points <= 0:
+        return None
+    return str(problem_id), points
+
+
+async def handle_batch(
+    websocket: WebSocket, wire_format: str, room_id: str, username: str, items
+):
+    # All submissions are scored in one script call and everything goes out as
+    # one "batch" event; the sender gets a result per item, by index.
+    if not isinstance(items, list) or not 0 < len(items) <= BATCH_MAX_ITEMS:
+        await send_message(
+            websocket,
+            wire_format,
+            {"error": f"batch needs 1 to {BATCH_MAX_ITEMS} items"},
+        )
+        return
+
+    results: list[dict] = []
+    submissions: list[tuple[str, int]] = []
+    for index, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        item_type = item.get("type")
+        if item_type == "chat":
+            results.append({"index": index, "ok": True})
+        elif item_type == "submission":
+            submission = parse_submission(item)
+            if submission is None:
+                results.append(
+                    {"index": index, "error": "Invalid problem_id or points"}
+                )
+                continue
+            submissions.append(submission)
+            results.append({"index": index, "ok": True})
+        else:
+            results.append({"index": index, "error": "unknown message type"})
+
+    scored = iter(
+        await score_submissions(room_id, username, submissions) if submissions else ()
+    )
+    timestamp = iso_now()
+    events = []
+    chats = 0
+    for result in results:
+        if "error" in result:
+            continue
+        item = items[result["index"]]
+        if item["type"] == "chat":
+            chats += 1
+            events.append(
+                {
+                    "type": "chat",
+                    "username": username,
+                    "message": item.get("message", ""),
+                    "timestamp": timestamp,
+                }
+            )
+            continue
+        new_score, bonus_awarded, rank = next(scored)
+        result.update(new_score=new_score, bonus_awarded=bonus_awarded, rank=rank)
+        events.append(
+            {
+                "type": "submission",
+                "username": username,
+                "problem_id": str(item["problem_id"]),
+                "points": int(item["points"]),
+                "new_score": new_score,
+                "bonus_awarded": bonus_awarded,
+                "rank": rank,
+                "timestamp": timestamp,
+            }
+        )
+
+    if events:
+        batch_event = {
+            "type": "batch",
+            "username": username,
+            "events": events,
+            "timestamp": timestamp,
+        }
+        await publish_room_event(
+            room_id, batch_event, stats={"messages_sent": chats} if chats else None
+        )
+    if submissions:
+        mark_scoreboard_dirty(room_id)
+    await send_message(
+        websocket, wire_format, {"type": "batch_result", "results": results}
+    )
+
 
 @router.get("/hi")
 async def giveMeHi():
     return {"message": "hi"}
 
 
+@router.get("/rate-limits")
+async def get_rate_limit_stats():
+    return {"backend": RATE_LIMIT_BACKEND, **rate_limit_stats}
+
+
+async def handle_message(
+    websocket: WebSocket, wire_format: str, room_id: str, username: str, frame: dict
+):
+    try:
+        with span("decode"):
+            msg = decode_frame(frame, wire_format)
+    except ValueError:
+        error = "Invalid JSON" if wire_format == JSON else "Invalid message"
+        await send_message(websocket, wire_format, {"error": error})
+        return
+
+    msg_type = msg.get("type")
+    set_trace_kind(str(msg_type))
+
+    items = msg.get("items")
+    cost = len(items) if msg_type == "batch" and isinstance(items, list) else 1
+    with span("rate_limit"):
+        allowed = await allow_message(room_id, username, max(cost, 1))
+    if not allowed:
+        await send_message(websocket, wire_format, {"error": "rate limited"})
+        return
+
+    if msg_type == "chat":
+        event = {
+            "type": "chat",
+            "username": username,
+            "message": msg.get("message", ""),
+            "timestamp": iso_now(),
+        }
+
+        await publish_room_event(room_id, event, stats={"messages_sent": 1})
+
+    elif msg_type == "submission":
+        submission = parse_submission(msg)
+        if submission is None:
+            await send_message(
+                websocket,
+                wire_format,
+                {"error": "Invalid problem_id or points"},
+            )
+            return
+        problem_id, points = submission
+
+        new_score, bonus_awarded, rank = await score_submission(
+            room_id, username, problem_id, points
+        )
+
+        event = {
+            "type": "submission",
+            "username": username,
+            "problem_id": problem_id,
+            "points": points,
+            "new_score": new_score,
+            "bonus_awarded": bonus_awarded,
+            "rank": rank,
+            "timestamp": iso_now(),
+        }
+        await publish_room_event(room_id, event)
+        mark_scoreboard_dirty(room_id)
+
+    elif msg_type == "batch":
+        await handle_batch(websocket, wire_format, room_id, username, items)
+
+    else:
+        await send_message(websocket, wire_format, {"error": "unknown message type"})
+
+
+# Registered before /{room_id}, which would otherwise take "leaderboard" as a
+# room id.
+@router.websocket("/leaderboard")
+async def websocketEndpoint(websocket: WebSocket):
+    await websocket.accept()
+    room_id = "OPD-5"
+    pubsub = pubsub_client.pubsub()
+    await pubsub.subscribe(k_event_channel(room_id))
+    try:
+        async for message in pubsub.listen():
+            if message["type"] == "message":
+                # Already-encoded JSON; forwarded without a decode/encode pass.
+                await websocket.send_text(message["data"])
+    finally:
+        await pubsub.unsubscribe(k_event_channel(room_id))
+        await pubsub.close()
+
+
 @router.websocket("/{room_id}")
 async def websocket_room(websocket: WebSocket, room_id: str):
     q = websocket.query_params
     username = q.get("username")
     token = q.get("token")
+    last_event_id = q.get("last_event_id")
+
+    if is_draining():
+        # Refused before auth, so a restarting worker does no more work.
+        await websocket.close(
+            code=status.WS_1012_SERVICE_RESTART, reason="server restarting"
+        )
+        return
 
     if not username or not token:
         await websocket.close(
@@ -48,6 +262,7 @@ async def websocket_room(websocket: WebSocket, room_id: str):
         return
 
     if token_username != username:
+        count_auth_failure("username_mismatch")
         await websocket.close(
             code=status.WS_1008_POLICY_VIOLATION,
             reason="username mismatch with token!",
@@ -55,140 +270,57 @@ async def websocket_room(websocket: WebSocket, room_id: str):
         print("username mismatch with token!")
         return
 
-    await websocket.accept()
+    try:
+        await migrate_legacy_rooms([room_id])
+    except Exception:
+        count_error("ws_legacy_keys")
 
-    clients = connected.setdefault(room_id, set())
-    clients.add(websocket)
+    wire_format = negotiate_format(websocket)
+    await websocket.accept(subprotocol=None if wire_format == JSON else wire_format)
 
-    if room_id not in pubsub_tasks:
-        task = asyncio.create_task(room_pubsub_worker(room_id))
-        pubsub_tasks[room_id] = task
+    register_client(room_id, websocket, last_event_id, wire_format)
 
     try:
-        await redis_client.sadd(k_users(room_id), username)
+        await subscribe_room(room_id)
     except Exception:
-        pass
+        count_error("ws_subscribe")
+    await replay_room_events(room_id, websocket)
+
+    if room_id not in scoreboard_tasks:
+        task = asyncio.create_task(scoreboard_ticker(room_id))
+        scoreboard_tasks[room_id] = task
 
-    join_event = {
-        "type": "system",
-        "action": "join",
-        "username": username,
-        "timestamp": iso_now(),
-    }
     try:
-        await publish_room_event(room_id, join_event)
+        await presence_join(room_id, username)
     except Exception:
-        pass
+        count_error("ws_presence")
+    request_scoreboard_keyframe(room_id)
 
     try:
         while True:
-            raw = await websocket.receive_text()
-            try:
-                msg = json.loads(raw)
-            except json.JSONDecodeError:
-                await websocket.send_json({"error": "Invalid JSON"})
-                continue
-
-            msg_type = msg.get("type")
-
-            if msg_type == "chat":
-                await redis_client.hincrby(f"room:{room_id}:stats", "messages_sent", 1)
-
-                event = {
-                    "type": "chat",
-                    "username": username,
-                    "message": msg.get("message", ""),
-                    "timestamp": iso_now(),
-                }
-
-                await publish_room_event(room_id, event)
-
-            elif msg_type == "submission":
-                problem_id = msg.get("problem_id")
-                points = int(msg.get("points", 0))
-
-                if not problem_id or points <= 0:
-                    await websocket.send_json({"error": "Invalid problem_id or points"})
-                    continue
-
-                await redis_client.hincrby(f"room:{room_id}:stats", "submissions", 1)
-
-                new_score = await redis_client.zincrby(
-                    f"room:{room_id}:leaderboard", points, username
-                )
-
-                bonus_awarded = False
-                key_first = f"problem:{room_id}:{problem_id}:first_solver"
-                if await redis_client.set(key_first, username, nx=True):
-                    bonus_points = 10
-                    new_score = await redis_client.zincrby(
-                        f"room:{room_id}:leaderboard", bonus_points, username
-                    )
-                    bonus_awarded = True
-
-                event = {
-                    "type": "submission",
-                    "username": username,
-                    "problem_id": problem_id,
-                    "points": points,
-                    "new_score": new_score,
-                    "bonus_awarded": bonus_awarded,
-                    "timestamp": iso_now(),
-                }
-                await publish_room_event(room_id, event)
-
-                leaderboard_snapshot = await get_leaderboard(room_id, top_n=50)
-                scoreboard_event = {
-                    "type": "system",
-                    "action": "scoreboard_update",
-                    "leaderboard": leaderboard_snapshot,
-                    "timestamp": iso_now(),
-                }
-
-                await publish_room_event(room_id, scoreboard_event)
-
-            else:
-                await websocket.send_json({"error": "unknown message type"})
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                break
+            with traced(room_id, "message"):
+                await handle_message(websocket, wire_format, room_id, username, frame)
     except WebSocketDisconnect:
         pass
     except Exception:
-        pass
+        count_error("ws_handler")
     finally:
-        connected.get(room_id, set()).discard(websocket)
-        if not connected.get(room_id):
-            task = pubsub_tasks.pop(room_id, None)
-            if task:
-                task.cancel()
-
-        try:
-            await redis_client.srem(k_users(room_id), username)
-        except Exception:
-            pass
-
-        leave_event = {
-            "type": "system",
-            "action": "leave",
-            "username": username,
-            "timestamp": iso_now(),
-        }
+        if unregister_client(room_id, websocket):
+            try:
+                await unsubscribe_room(room_id)
+            except Exception:
+                count_error("ws_unsubscribe")
+            # Same recheck for the ticker: a socket that joined during the
+            # await above reused the running one.
+            if not connected.get(room_id):
+                task = scoreboard_tasks.pop(room_id, None)
+                if task:
+                    task.cancel()
 
         try:
-            await publish_room_event(room_id, leave_event)
+            await presence_leave(room_id, username)
         except Exception:
-            pass
-
-
-@router.websocket("/leaderboard")
-async def websocketEndpoint(websocket: WebSocket):
-    await websocket.accept()
-    room_id = "OPD-5"
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe(f"room:{room_id}:events")
-    try:
-        async for message in pubsub.listen():
-            if message["type"] == "message":
-                data = json.loads(message["data"])
-                await websocket.send_json(data)
-    finally:
-        await pubsub.unsubscribe(f"room:{room_id}:events")
-        await pubsub.close()
+            count_error("ws_presence")
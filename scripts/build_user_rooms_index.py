@@ -0,0 +1,44 @@
+"""Build the user:{username}:rooms reverse index from existing room members.
+
+Usage: REDIS_URL=redis://localhost:6379/0 python -m scripts.build_user_rooms_index
+
+Safe to re-run: it only SADDs, so it can run while the app is serving.
+"""
+
+import asyncio
+
+from helpers.keys import ROOMS_ALL, k_members, k_user_rooms
+from services.redis_setup import redis_client
+
+PAGE_SIZE = 500
+
+
+async def main():
+    cursor = 0
+    rooms = 0
+    entries = 0
+    while True:
+        cursor, room_ids = await redis_client.sscan(
+            ROOMS_ALL, cursor=cursor, count=PAGE_SIZE
+        )
+        room_ids = list(room_ids)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for room_id in room_ids:
+                pipe.smembers(k_members(room_id))
+            all_members = await pipe.execute()
+
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for room_id, members in zip(room_ids, all_members):
+                for member in members:
+                    pipe.sadd(k_user_rooms(member), room_id)
+                    entries += 1
+            await pipe.execute()
+
+        rooms += len(room_ids)
+        if cursor == 0:
+            break
+    print(f"Indexed {entries} memberships across {rooms} rooms.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""Move legacy per-room keys to the {room_id} hash-tagged layout in helpers/keys.py.
+
+Usage: REDIS_URL=redis://localhost:6379/0 python -m scripts.migrate_hash_tagged_keys
+       [--dry-run] [--batch 500]
+
+Deploy the new code first, then run this while it serves traffic. Until it is
+done, the app moves a room's legacy keys itself the first time the room is
+used (LEGACY_KEY_FALLBACK, services/legacy_keys.py). The script and the app
+take the same per-room lock, so no key is merged twice. Each legacy key is
+merged into its new key (which may already hold writes made since the deploy)
+and then UNLINKed:
+- stats hashes: counters are added together
+- meta hashes: fields are only filled in where missing
+- sets: unioned
+- leaderboards: scores are added together
+- history lists: old entries are appended after the newer ones
+- first-solver strings: the legacy value wins, since it was set first
+- streams: copied only if the new stream does not exist yet
+Legacy room keys the new layout has no place for (room:ABC:users, replaced
+by the presence ZSET) are UNLINKed without being moved.
+Re-running is safe; migrated keys no longer match, and keys of a room that
+is being migrated by the app at that moment are counted as skipped. Finally,
+the user:{username}:rooms index is rebuilt from room members. Once a run
+reports nothing to migrate, set LEGACY_KEY_FALLBACK=false.
+"""
+
+import asyncio
+import sys
+
+from scripts.build_user_rooms_index import main as build_user_rooms_index
+from services.legacy_keys import migrate_keys
+from services.redis_setup import redis_client
+
+
+async def main():
+    dry_run = "--dry-run" in sys.argv
+    batch = 500
+    if "--batch" in sys.argv:
+        batch = int(sys.argv[sys.argv.index("--batch") + 1])
+
+    migrated = dropped = skipped = 0
+    for pattern in ("room:*", "problem:*"):
+        keys: list[str] = []
+        async for key in redis_client.scan_iter(match=pattern, count=batch):
+            keys.append(key)
+            if len(keys) >= batch:
+                done, gone, left = await migrate_keys(keys, dry_run)
+                migrated, dropped = migrated + done, dropped + gone
+                skipped += left
+                keys = []
+        done, gone, left = await migrate_keys(keys, dry_run)
+        migrated, dropped, skipped = migrated + done, dropped + gone, skipped + left
+
+    verb = "Would migrate" if dry_run else "Migrated"
+    drop = "would drop" if dry_run else "dropped"
+    print(f"{verb} {migrated} keys, {drop} {dropped} obsolete, skipped {skipped}.")
+    if not dry_run:
+        # GET /rooms/ drops index entries whose room has no meta, which older
+        # releases could do to rooms that were not migrated yet.
+        await build_user_rooms_index()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
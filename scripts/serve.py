@@ -0,0 +1,177 @@
+"""Run the app in several worker processes with graceful, rolling restarts.
+
+Usage: python -m scripts.serve [--host 0.0.0.0] [--port 8000] [--workers 4]
+
+The launcher binds the socket once and starts one uvicorn server per worker
+on it. A worker that is asked to stop first stops accepting connections, then
+drains its websockets (services/drain.py): each client gets a reconnect event
+with a jittered retry_after_ms before its socket is closed with 1012. Plain
+`uvicorn main:app --workers N` closes every socket at once instead.
+
+Signals:
+- SIGTERM / SIGINT: all workers drain and exit.
+- SIGHUP: rolling restart. Workers are replaced one at a time, and each old
+  worker is only drained once its replacement is serving.
+Workers that die are started again. A worker that dies before it ever served
+is restarted after a backoff that doubles from RESPAWN_BACKOFF_MIN up to
+RESPAWN_BACKOFF_MAX seconds, so one that crashes on startup does not spin.
+"""
+
+import utils.env  # noqa: F401  isort: skip
+import argparse
+import multiprocessing
+import os
+import signal
+import time
+
+import uvicorn
+
+from services.drain import DRAIN_SECONDS, drain_connections
+
+APP = "main:create_app"
+# Time a worker gets, on top of the drain, for uvicorn's and the app's own
+# shutdown before it is killed.
+WORKER_EXIT_GRACE = 15.0
+WORKER_START_TIMEOUT = 30.0
+RESPAWN_BACKOFF_MIN = 1.0
+RESPAWN_BACKOFF_MAX = 60.0
+
+launcher_state = {"stop": False, "restart": False}
+# Worker slot -> startup failures in a row, and when it may be started again.
+respawn_failures: dict[int, int] = {}
+respawn_at: dict[int, float] = {}
+
+
+class DrainingServer(uvicorn.Server):
+    def __init__(self, config: uvicorn.Config, ready):
+        super().__init__(config)
+        self.ready = ready
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets)
+        if self.started:
+            self.ready.set()
+
+    async def shutdown(self, sockets=None):
+        # Stop accepting first, so new sockets go to the other workers, and
+        # drain before uvicorn closes whatever is left.
+        for server in self.servers:
+            server.close()
+        await drain_connections()
+        await super().shutdown(sockets)
+
+
+def run_worker(config: uvicorn.Config, sock, ready):
+    config.configure_logging()
+    DrainingServer(config, ready).run(sockets=[sock])
+
+
+def start_worker(context, config: uvicorn.Config, sock):
+    ready = context.Event()
+    process = context.Process(target=run_worker, args=(config, sock, ready))
+    process.start()
+    return process, ready
+
+
+def stop_worker(process):
+    if process.is_alive():
+        os.kill(process.pid, signal.SIGTERM)
+    process.join(DRAIN_SECONDS + WORKER_EXIT_GRACE)
+    if process.is_alive():
+        print(f"Worker {process.pid} did not exit in time, killing it")
+        process.kill()
+        process.join()
+
+
+def rolling_restart(context, config: uvicorn.Config, sock, workers: list):
+    for index, (old, _) in enumerate(list(workers)):
+        if launcher_state["stop"]:
+            return
+        process, ready = start_worker(context, config, sock)
+        if not ready.wait(WORKER_START_TIMEOUT):
+            print(f"Worker {process.pid} failed to start, keeping {old.pid}")
+            stop_worker(process)
+            return
+        workers[index] = (process, ready)
+        respawn_at.pop(index, None)
+        stop_worker(old)
+        print(f"Replaced worker {old.pid} with {process.pid}")
+
+
+def respawn_delay(index: int, ready) -> float:
+    # A worker that got as far as serving is replaced right away; one that
+    # never did is probably failing on startup.
+    failures = 0 if ready.is_set() else respawn_failures.get(index, 0) + 1
+    respawn_failures[index] = failures
+    if not failures:
+        return 0.0
+    return min(RESPAWN_BACKOFF_MAX, RESPAWN_BACKOFF_MIN * 2 ** (failures - 1))
+
+
+def respawn_dead(context, config: uvicorn.Config, sock, workers: list):
+    now = time.monotonic()
+    for index, (process, ready) in enumerate(workers):
+        if process.is_alive() or launcher_state["stop"]:
+            continue
+        if index not in respawn_at:
+            delay = respawn_delay(index, ready)
+            respawn_at[index] = now + delay
+            print(
+                f"Worker {process.pid} exited ({process.exitcode}), "
+                f"restarting in {delay:.0f}s"
+            )
+        if now >= respawn_at[index]:
+            del respawn_at[index]
+            workers[index] = start_worker(context, config, sock)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))),
+    )
+    return parser.parse_args()
+
+
+def request(flag: str):
+    def handler(signum, frame):
+        launcher_state[flag] = True
+
+    return handler
+
+
+def main():
+    args = parse_args()
+    config = uvicorn.Config(
+        APP, factory=True, host=args.host, port=args.port, lifespan="on"
+    )
+    sock = config.bind_socket()
+    context = multiprocessing.get_context("spawn")
+    workers = [start_worker(context, config, sock) for _ in range(args.workers)]
+
+    signal.signal(signal.SIGTERM, request("stop"))
+    signal.signal(signal.SIGINT, request("stop"))
+    signal.signal(signal.SIGHUP, request("restart"))
+
+    while not launcher_state["stop"]:
+        time.sleep(0.5)
+        if launcher_state["restart"]:
+            launcher_state["restart"] = False
+            rolling_restart(context, config, sock, workers)
+        respawn_dead(context, config, sock, workers)
+
+    # Workers drain side by side; the whole launcher exits in about one drain.
+    for process, _ in workers:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+    for process, _ in workers:
+        stop_worker(process)
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
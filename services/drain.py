@@ -0,0 +1,77 @@
+import asyncio
+import os
+import random
+import time
+
+from fastapi import WebSocket, status
+
+from services.metrics import count_error
+from services.node_registry import register_node
+from services.serialization import dumps
+from services.websocket_pubsub import connected, iso_now, send_queues
+from services.wire_format import encode_frame
+
+# On shutdown a worker stops taking sockets and closes the ones it has over
+# DRAIN_SECONDS, in random order. Each client first gets a reconnect event with
+# a random retry_after_ms in [RECONNECT_MIN_MS, RECONNECT_MAX_MS], so a rolling
+# restart spreads reconnects out instead of sending every client back at once.
+DRAIN_SECONDS = float(os.getenv("DRAIN_SECONDS", "10"))
+RECONNECT_MIN_MS = int(os.getenv("RECONNECT_MIN_MS", "500"))
+RECONNECT_MAX_MS = int(os.getenv("RECONNECT_MAX_MS", "5000"))
+DRAIN_FLUSH_SECONDS = 1.0
+
+drain_state = {"draining": False, "sockets_drained": 0}
+
+
+def is_draining() -> bool:
+    return drain_state["draining"]
+
+
+def reconnect_event() -> dict:
+    return {
+        "type": "system",
+        "action": "reconnect",
+        "retry_after_ms": random.randint(RECONNECT_MIN_MS, RECONNECT_MAX_MS),
+        "timestamp": iso_now(),
+    }
+
+
+async def drain_socket(websocket: WebSocket, delay: float):
+    await asyncio.sleep(delay)
+    queue = send_queues.get(websocket)
+    if queue is not None and queue.put(
+        encode_frame(dumps(reconnect_event()), queue.wire_format)
+    ):
+        # Let the writer send what is queued, the reconnect event last; it
+        # pops a frame before sending it, so wait until it is idle, not just
+        # until the queue is empty.
+        deadline = time.monotonic() + DRAIN_FLUSH_SECONDS
+        while not queue.idle() and not queue.closed and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+    try:
+        await websocket.close(
+            code=status.WS_1012_SERVICE_RESTART, reason="server restarting"
+        )
+    except Exception:
+        count_error("drain_close")
+    drain_state["sockets_drained"] += 1
+
+
+async def drain_connections(seconds: float = DRAIN_SECONDS):
+    # Safe to call more than once; only the first call drains.
+    if drain_state["draining"]:
+        return
+    drain_state["draining"] = True
+    try:
+        await register_node("draining")
+    except Exception:
+        count_error("drain_register")
+    sockets = [ws for clients in connected.values() for ws in clients]
+    if not sockets:
+        return
+    random.shuffle(sockets)
+    step = seconds / len(sockets)
+    await asyncio.gather(
+        *(drain_socket(ws, index * step) for index, ws in enumerate(sockets)),
+        return_exceptions=True,
+    )
@@ -0,0 +1,237 @@
+import asyncio
+import os
+import re
+import time
+from typing import Dict
+
+from fastapi.requests import HTTPConnection
+
+from helpers.keys import ROOM_KEY_SUFFIXES, k_first_solver, k_migration_lock, k_room
+from services.redis_setup import redis_client
+from services.websocket_pubsub import MAX_HISTORY
+
+# Rooms created before keys were hash-tagged still live under room:ABC:meta and
+# friends. Until scripts/migrate_hash_tagged_keys has moved all of them, every
+# request that touches a room first moves that room's legacy keys over, so no
+# room reads as missing or empty in between. Turn this off once the script
+# reports nothing left to migrate.
+LEGACY_KEY_FALLBACK = os.getenv("LEGACY_KEY_FALLBACK", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# The per-room keys of the pre-hash-tag layout. room:ABC:users was replaced by
+# the presence ZSET, which heartbeats rebuild; the script drops it.
+LEGACY_ROOM_SUFFIXES = ("meta", "members", "leaderboard", "stats", "history", "stream")
+MIGRATION_LOCK_SECONDS = 30
+LEGACY_CHECKED_MAX = 100000
+
+LEGACY_ROOM_KEY = re.compile(r"^room:([^{}:]+):([a-z]+)$")
+LEGACY_FIRST_SOLVER_KEY = re.compile(r"^problem:([^{}:]+):(.+):first_solver$")
+
+# Rooms and (room, problem) pairs this worker already found clean.
+checked_rooms: set[str] = set()
+checked_first_solvers: set[tuple[str, str]] = set()
+
+
+def legacy_room_key(room_id: str, suffix: str) -> str:
+    return f"room:{room_id}:{suffix}"
+
+
+def legacy_first_solver_key(room_id: str, problem_id: str) -> str:
+    return f"problem:{room_id}:{problem_id}:first_solver"
+
+
+def new_key_for(key: str):
+    # Returns (room id, new key, suffix), or Nones for keys of other shapes.
+    # Legacy room keys with no counterpart in the new layout, such as
+    # room:ABC:users, get a None new key: they are dropped, not moved.
+    match = LEGACY_ROOM_KEY.match(key)
+    if match:
+        room_id, suffix = match.groups()
+        if suffix not in ROOM_KEY_SUFFIXES:
+            return room_id, None, suffix
+        return room_id, k_room(room_id, suffix), suffix
+    match = LEGACY_FIRST_SOLVER_KEY.match(key)
+    if match:
+        room_id, problem_id = match.groups()
+        return room_id, k_first_solver(room_id, problem_id), "first_solver"
+    return None, None, None
+
+
+def read_legacy(pipe, key: str, key_type: str):
+    if key_type == "hash":
+        pipe.hgetall(key)
+    elif key_type == "set":
+        pipe.smembers(key)
+    elif key_type == "zset":
+        pipe.zrange(key, 0, -1, withscores=True)
+    elif key_type == "list":
+        pipe.lrange(key, 0, -1)
+    elif key_type == "string":
+        pipe.get(key)
+    elif key_type == "stream":
+        pipe.xrange(key)
+    else:
+        pipe.type(key)
+
+
+def write_merged(pipe, new_key: str, suffix: str, key_type: str, value) -> bool:
+    if key_type == "hash" and value:
+        for field, field_value in value.items():
+            if suffix == "stats":
+                pipe.hincrby(new_key, field, int(field_value))
+            else:
+                pipe.hsetnx(new_key, field, field_value)
+    elif key_type == "set" and value:
+        pipe.sadd(new_key, *value)
+    elif key_type == "zset":
+        for member, score in value:
+            pipe.zincrby(new_key, score, member)
+    elif key_type == "list" and value:
+        pipe.rpush(new_key, *value)
+        if suffix == "history":
+            pipe.ltrim(new_key, 0, MAX_HISTORY - 1)
+    elif key_type == "string" and value is not None:
+        pipe.set(new_key, value)
+    elif key_type == "stream":
+        for entry_id, fields in value:
+            pipe.xadd(new_key, fields, id=entry_id)
+    else:
+        return False
+    return True
+
+
+async def lock_rooms(room_ids: list[str]) -> list[str]:
+    # Merges add counters and scores together, so a key must only ever be
+    # merged once; the script and every worker take the same per-room lock.
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for room_id in room_ids:
+            pipe.set(k_migration_lock(room_id), 1, nx=True, ex=MIGRATION_LOCK_SECONDS)
+        acquired = await pipe.execute()
+    return [room_id for room_id, ok in zip(room_ids, acquired) if ok]
+
+
+async def wait_for_rooms(room_ids: list[str]):
+    deadline = time.monotonic() + MIGRATION_LOCK_SECONDS
+    while time.monotonic() < deadline:
+        if not await redis_client.exists(*[k_migration_lock(r) for r in room_ids]):
+            return
+        await asyncio.sleep(0.05)
+
+
+async def migrate_keys(keys: list[str], dry_run: bool = False) -> tuple[int, int, int]:
+    # Returns (migrated, dropped, skipped). Keys of rooms another process is
+    # migrating right now are skipped; they are gone by the time that process
+    # is done.
+    targets: Dict[str, list[tuple[str, str, str]]] = {}
+    for key in keys:
+        room_id, new_key, suffix = new_key_for(key)
+        if room_id is not None:
+            targets.setdefault(room_id, []).append((key, new_key, suffix))
+    if not targets:
+        return 0, 0, 0
+
+    locked = list(targets) if dry_run else await lock_rooms(list(targets))
+    skipped = sum(len(targets[r]) for r in targets if r not in locked)
+    plan_targets = [t for room_id in locked for t in targets[room_id]]
+    try:
+        if not plan_targets:
+            return 0, 0, skipped
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for key, new_key, _ in plan_targets:
+                pipe.type(key)
+                pipe.exists(new_key or key)
+            info = await pipe.execute()
+        types = info[0::2]
+        new_exists = info[1::2]
+
+        # Streams can't be merged without breaking id order; leave those for a
+        # manual look.
+        plan = []
+        obsolete = []
+        for (key, new_key, suffix), key_type, exists in zip(
+            plan_targets, types, new_exists
+        ):
+            if key_type == "none" or (key_type == "stream" and exists):
+                skipped += 1
+            elif new_key is None:
+                obsolete.append(key)
+            else:
+                plan.append((key, new_key, suffix, key_type))
+        if dry_run:
+            return len(plan), len(obsolete), skipped
+        if obsolete:
+            await redis_client.unlink(*obsolete)
+        if not plan:
+            return 0, len(obsolete), skipped
+
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for key, _, _, key_type in plan:
+                read_legacy(pipe, key, key_type)
+            values = await pipe.execute()
+
+        migrated = 0
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for (key, new_key, suffix, key_type), value in zip(plan, values):
+                if write_merged(pipe, new_key, suffix, key_type, value):
+                    pipe.unlink(key)
+                    migrated += 1
+                else:
+                    skipped += 1
+            await pipe.execute()
+        return migrated, len(obsolete), skipped
+    finally:
+        if locked and not dry_run:
+            await redis_client.delete(*[k_migration_lock(r) for r in locked])
+
+
+async def migrate_legacy_keys(keys: list[str]):
+    # Request path: moves whatever of `keys` still exists, waiting for another
+    # process that already holds a room's lock instead of skipping it.
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.exists(key)
+        found = [key for key, exists in zip(keys, await pipe.execute()) if exists]
+    if not found:
+        return
+    _, _, skipped = await migrate_keys(found)
+    if skipped:
+        await wait_for_rooms(sorted({new_key_for(key)[0] for key in found}))
+
+
+async def migrate_legacy_rooms(room_ids):
+    if not LEGACY_KEY_FALLBACK:
+        return
+    pending = [r for r in dict.fromkeys(room_ids) if r not in checked_rooms]
+    if not pending:
+        return
+    await migrate_legacy_keys(
+        [legacy_room_key(r, s) for r in pending for s in LEGACY_ROOM_SUFFIXES]
+    )
+    if len(checked_rooms) > LEGACY_CHECKED_MAX:
+        checked_rooms.clear()
+    checked_rooms.update(pending)
+
+
+async def migrate_legacy_first_solvers(room_id: str, problem_ids):
+    if not LEGACY_KEY_FALLBACK:
+        return
+    pending = [
+        p
+        for p in dict.fromkeys(problem_ids)
+        if (room_id, p) not in checked_first_solvers
+    ]
+    if not pending:
+        return
+    await migrate_legacy_keys([legacy_first_solver_key(room_id, p) for p in pending])
+    if len(checked_first_solvers) > LEGACY_CHECKED_MAX:
+        checked_first_solvers.clear()
+    checked_first_solvers.update((room_id, p) for p in pending)
+
+
+async def migrate_legacy_room_param(connection: HTTPConnection):
+    # Router dependency for routes with a {room_id} path parameter.
+    room_id = connection.path_params.get("room_id")
+    if room_id is not None:
+        await migrate_legacy_rooms([room_id])
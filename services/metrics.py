@@ -0,0 +1,90 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict
+
+# In-process metrics for GET /metrics. Everything here is touched from the
+# event loop only, so plain ints and lists are enough: no locks, no atomics.
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+redis_command_seconds: Dict[str, Histogram] = defaultdict(Histogram)
+fan_out_seconds = Histogram()
+# Exceptions that are handled (often swallowed) on purpose, by location.
+errors: Dict[str, int] = defaultdict(int)
+auth_failures: Dict[str, int] = defaultdict(int)
+
+
+def observe_redis_command(command, started: float):
+    name = command.decode() if isinstance(command, bytes) else str(command)
+    redis_command_seconds[name.upper()].observe(time.perf_counter() - started)
+
+
+def count_error(where: str):
+    errors[where] += 1
+
+
+def count_auth_failure(reason: str):
+    auth_failures[reason] += 1
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{k}="{escape_label(v)}"' for k, v in labels.items())
+    return "{" + pairs + "}"
+
+
+def render_metric(name: str, kind: str, help_text: str, samples) -> list[str]:
+    # samples: (labels dict, value) pairs, in Prometheus text format 0.0.4.
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(labels)} {value}")
+    return lines
+
+
+def render_histogram(name: str, help_text: str, histograms) -> list[str]:
+    # histograms: (labels dict, Histogram) pairs.
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, histogram in histograms:
+        cumulative = 0
+        for bound, count in zip(histogram.bounds + ("+Inf",), histogram.counts):
+            cumulative += count
+            bucket_labels = format_labels({**labels, "le": bound})
+            lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {histogram.total}")
+        lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+    return lines
@@ -0,0 +1,85 @@
+import os
+import socket
+import uuid
+
+from helpers.keys import NODES_ALL, k_node_lease
+from services.redis_setup import redis_client
+from services.serialization import dumps, loads
+from services.websocket_pubsub import connected, iso_now
+
+# Every worker process is a node: it adds itself to nodes:all and keeps a
+# node:{id}:lease key alive, refreshed by the presence heartbeat. The lease
+# holds what the node is doing, so /debug/nodes can show the whole fleet; a
+# node whose lease expired is dropped from the set the next time it is read.
+NODE_ID = (
+    os.getenv("NODE_ID")
+    or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+)
+# The presence heartbeat refreshes the lease, and presence only counts
+# members whose node still has one, so the lease lives exactly as long as a
+# presence entry. Both settings live here, where the lease is written, and
+# services/presence.py imports them.
+PRESENCE_HEARTBEAT_SECONDS = float(os.getenv("PRESENCE_HEARTBEAT_SECONDS", "10"))
+PRESENCE_TTL_SECONDS = int(os.getenv("PRESENCE_TTL_SECONDS", "30"))
+if PRESENCE_TTL_SECONDS <= PRESENCE_HEARTBEAT_SECONDS:
+    raise ValueError(
+        "PRESENCE_TTL_SECONDS must be longer than PRESENCE_HEARTBEAT_SECONDS"
+    )
+
+# serving | draining
+node_state = {"status": "serving", "started_at": iso_now()}
+
+
+def node_info() -> dict:
+    return {
+        "node_id": NODE_ID,
+        "host": socket.gethostname(),
+        "pid": os.getpid(),
+        "status": node_state["status"],
+        "started_at": node_state["started_at"],
+        "sockets": sum(len(clients) for clients in connected.values()),
+        "rooms": len(connected),
+        "updated_at": iso_now(),
+    }
+
+
+def queue_node_lease(pipe):
+    pipe.set(k_node_lease(NODE_ID), dumps(node_info()), ex=PRESENCE_TTL_SECONDS)
+    pipe.sadd(NODES_ALL, NODE_ID)
+
+
+async def register_node(status: str = "serving"):
+    node_state["status"] = status
+    async with redis_client.pipeline(transaction=False) as pipe:
+        queue_node_lease(pipe)
+        await pipe.execute()
+
+
+async def deregister_node():
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.delete(k_node_lease(NODE_ID))
+        pipe.srem(NODES_ALL, NODE_ID)
+        await pipe.execute()
+
+
+async def list_nodes() -> list[dict]:
+    node_ids = sorted(await redis_client.smembers(NODES_ALL))
+    if not node_ids:
+        return []
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for node_id in node_ids:
+            pipe.get(k_node_lease(node_id))
+        leases = await pipe.execute()
+    dead = [node_id for node_id, lease in zip(node_ids, leases) if lease is None]
+    if dead:
+        await redis_client.srem(NODES_ALL, *dead)
+    nodes = []
+    for node_id, lease in zip(node_ids, leases):
+        if lease is None:
+            continue
+        try:
+            nodes.append(loads(lease))
+        except ValueError:
+            # Written by an older release, which stored only a timestamp.
+            nodes.append({"node_id": node_id, "updated_at": lease})
+    return nodes
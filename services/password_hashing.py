@@ -0,0 +1,59 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+BCRYPT_QUEUE_TIMEOUT = float(os.getenv("BCRYPT_QUEUE_TIMEOUT", "10"))
+
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event
+# loop without the cost of a process pool.
+hash_executor = ThreadPoolExecutor(
+    max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt"
+)
+hash_slots = asyncio.Semaphore(BCRYPT_WORKERS)
+
+hash_stats = {
+    "queued": 0,
+    "in_flight": 0,
+    "completed": 0,
+    "timeouts": 0,
+    "queue_wait_ms_total": 0.0,
+    "queue_wait_ms_max": 0.0,
+}
+
+
+async def run_bcrypt(fn, *args):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    hash_stats["queued"] += 1
+    try:
+        await asyncio.wait_for(hash_slots.acquire(), BCRYPT_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        hash_stats["timeouts"] += 1
+        raise
+    finally:
+        hash_stats["queued"] -= 1
+
+    waited_ms = (loop.time() - start) * 1000
+    hash_stats["queue_wait_ms_total"] += waited_ms
+    hash_stats["queue_wait_ms_max"] = max(hash_stats["queue_wait_ms_max"], waited_ms)
+    hash_stats["in_flight"] += 1
+    try:
+        return await loop.run_in_executor(hash_executor, fn, *args)
+    finally:
+        hash_stats["in_flight"] -= 1
+        hash_stats["completed"] += 1
+        hash_slots.release()
+
+
+async def hash_password(password: str) -> str:
+    hashed = await run_bcrypt(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt())
+    return hashed.decode("utf-8")
+
+
+async def check_password(password: str, hashed_password: str) -> bool:
+    return await run_bcrypt(
+        bcrypt.checkpw, password.encode("utf-8"), hashed_password.encode("utf-8")
+    )
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+from helpers.keys import k_node_lease, k_presence
+from services.metrics import count_error
+from services.node_registry import (
+    NODE_ID,
+    PRESENCE_HEARTBEAT_SECONDS,
+    PRESENCE_TTL_SECONDS,
+    queue_node_lease,
+)
+from services.redis_setup import redis_client
+from services.room_lifecycle import ROOM_IDLE_TTL, queue_room_touch
+from services.websocket_pubsub import iso_now, publish_room_event
+
+# room:{id}:presence is a ZSET of "username@node" scored by last-seen time.
+# Each node refreshes its own members and its registry lease every
+# PRESENCE_HEARTBEAT_SECONDS. A member counts only while its score is recent
+# and its node's lease is alive, so a crashed worker's users drop out within
+# one TTL instead of lingering forever. PRESENCE_HEARTBEAT_SECONDS and
+# PRESENCE_TTL_SECONDS are defined next to the lease, in node_registry.
+# Joins and leaves are batched into one presence_diff event per room per
+# interval; a leave and rejoin inside one interval cancel out.
+PRESENCE_DIFF_MS = int(os.getenv("PRESENCE_DIFF_MS", "1000"))
+
+# room_id -> username -> sockets on this node
+local_presence: Dict[str, Dict[str, int]] = {}
+pending_joins: Dict[str, set[str]] = {}
+pending_leaves: Dict[str, set[str]] = {}
+# node id -> (lease alive, when it was checked). Leases change on the scale of
+# PRESENCE_TTL_SECONDS, so one check is reused for a heartbeat interval.
+node_liveness: Dict[str, tuple[bool, float]] = {}
+NODE_LIVENESS_MAX = 10000
+
+
+def presence_member(username: str, node_id: str = NODE_ID) -> str:
+    return f"{username}@{node_id}"
+
+
+def record_change(room_id: str, username: str, joined: bool):
+    adds = pending_joins if joined else pending_leaves
+    cancels = pending_leaves if joined else pending_joins
+    if username in cancels.get(room_id, ()):
+        cancels[room_id].discard(username)
+    else:
+        adds.setdefault(room_id, set()).add(username)
+
+
+async def presence_join(room_id: str, username: str):
+    users = local_presence.setdefault(room_id, {})
+    users[username] = users.get(username, 0) + 1
+    if users[username] > 1:
+        return
+    record_change(room_id, username, joined=True)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zadd(k_presence(room_id), {presence_member(username): time.time()})
+        queue_node_lease(pipe)
+        queue_room_touch(pipe, room_id, force=True, hot_keys=(k_presence(room_id),))
+        await pipe.execute()
+
+
+async def presence_leave(room_id: str, username: str):
+    users = local_presence.get(room_id, {})
+    if username not in users:
+        return
+    users[username] -= 1
+    if users[username] > 0:
+        return
+    del users[username]
+    if not users:
+        local_presence.pop(room_id, None)
+    record_change(room_id, username, joined=False)
+    await redis_client.zrem(k_presence(room_id), presence_member(username))
+
+
+async def heartbeat_once():
+    now = time.time()
+    async with redis_client.pipeline(transaction=False) as pipe:
+        queue_node_lease(pipe)
+        for room_id, users in local_presence.items():
+            key = k_presence(room_id)
+            pipe.zadd(key, {presence_member(username): now for username in users})
+            # Anyone not refreshed within the TTL belongs to a dead node.
+            pipe.zremrangebyscore(key, "-inf", now - PRESENCE_TTL_SECONDS)
+            if ROOM_IDLE_TTL:
+                pipe.expire(key, ROOM_IDLE_TTL)
+        await pipe.execute()
+
+
+async def flush_presence_diffs():
+    rooms = sorted(set(pending_joins) | set(pending_leaves))
+    if not rooms:
+        return
+    changes = {
+        room_id: (pending_joins.pop(room_id, set()), pending_leaves.pop(room_id, set()))
+        for room_id in rooms
+    }
+    # A user with a live socket on another node neither joined nor left the
+    # room; only this node's view of them changed.
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for room_id in rooms:
+            queue_presence_members(pipe, room_id)
+        room_members = await pipe.execute()
+    for room_id, members in zip(rooms, room_members):
+        elsewhere = set(await online_users(members, exclude_node=NODE_ID))
+        joined = sorted(changes[room_id][0] - elsewhere)
+        left = sorted(changes[room_id][1] - elsewhere)
+        if not joined and not left:
+            continue
+        event = {
+            "type": "system",
+            "action": "presence_diff",
+            "joined": joined,
+            "left": left,
+            "timestamp": iso_now(),
+        }
+        await publish_room_event(room_id, event)
+
+
+async def presence_worker():
+    last_heartbeat = time.monotonic()
+    while True:
+        try:
+            await asyncio.sleep(PRESENCE_DIFF_MS / 1000)
+            await flush_presence_diffs()
+            if time.monotonic() - last_heartbeat >= PRESENCE_HEARTBEAT_SECONDS:
+                last_heartbeat = time.monotonic()
+                await heartbeat_once()
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            count_error("presence_worker")
+            print(f"Presence heartbeat failed: {e}")
+
+
+async def release_presence():
+    # Clean shutdown: drop this node's members right away.
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for room_id, users in local_presence.items():
+            pipe.zrem(k_presence(room_id), *[presence_member(u) for u in users])
+        await pipe.execute()
+    local_presence.clear()
+
+
+def queue_presence_members(pipe, room_id: str):
+    pipe.zrangebyscore(k_presence(room_id), time.time() - PRESENCE_TTL_SECONDS, "+inf")
+
+
+async def live_nodes(nodes) -> set[str]:
+    now = time.monotonic()
+    stale = [
+        node
+        for node in nodes
+        if node != NODE_ID
+        and now - node_liveness.get(node, (False, -PRESENCE_HEARTBEAT_SECONDS))[1]
+        >= PRESENCE_HEARTBEAT_SECONDS
+    ]
+    if stale:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for node in stale:
+                pipe.exists(k_node_lease(node))
+            leases = await pipe.execute()
+        if len(node_liveness) > NODE_LIVENESS_MAX:
+            node_liveness.clear()
+        for node, lease in zip(stale, leases):
+            node_liveness[node] = (bool(lease), now)
+    return {node for node in nodes if node == NODE_ID or node_liveness[node][0]}
+
+
+async def online_users(members, exclude_node: Optional[str] = None) -> list[str]:
+    # members as read by queue_presence_members.
+    entries = [member.rpartition("@") for member in members]
+    nodes = {node for _, _, node in entries if node != exclude_node}
+    if not nodes:
+        return []
+    alive = await live_nodes(sorted(nodes))
+    return sorted({username for username, _, node in entries if node in alive})
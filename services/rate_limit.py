@@ -0,0 +1,86 @@
+import os
+import time
+from typing import Dict
+
+from helpers.keys import k_rate_limit
+from services.redis_scripts import token_bucket_script
+from services.redis_setup import redis_client
+
+# Token buckets for websocket messages: RATE is tokens per second, BURST the
+# bucket size. A rate of 0 turns that bucket off.
+USER_RATE = float(os.getenv("RATE_LIMIT_USER_RATE", "20"))
+USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "40"))
+ROOM_RATE = float(os.getenv("RATE_LIMIT_ROOM_RATE", "200"))
+ROOM_BURST = float(os.getenv("RATE_LIMIT_ROOM_BURST", "400"))
+# local | redis. With redis, the in-process buckets still run first, so a
+# flooding client is turned away before any Redis I/O; the shared buckets then
+# keep users and rooms spread over several workers to one budget.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")
+RATE_LIMIT_MAX_BUCKETS = 100000
+
+# key -> [tokens, last refill (monotonic seconds)]
+buckets: Dict[str, list[float]] = {}
+rate_limit_stats = {"allowed": 0, "throttled_user": 0, "throttled_room": 0}
+
+
+def bucket_limits(room_id: str, username: str) -> list[tuple[str, str, float, float]]:
+    limits = []
+    if USER_RATE > 0:
+        limits.append(("user", username, USER_RATE, USER_BURST))
+    if ROOM_RATE > 0:
+        limits.append(("room", room_id, ROOM_RATE, ROOM_BURST))
+    return limits
+
+
+def bucket_threshold(cost: float, burst: float) -> float:
+    # A batch frame costs one token per item. One bigger than the burst could
+    # never find that many tokens, so it passes on a full bucket, is charged in
+    # full and leaves the bucket in debt until the refill pays it back.
+    return min(cost, burst)
+
+
+def take_local(limits, cost: float):
+    # Returns the scope of the first empty bucket, or None once tokens are
+    # taken from all of them. Nothing is taken unless every bucket has room.
+    now = time.monotonic()
+    if len(buckets) > RATE_LIMIT_MAX_BUCKETS:
+        buckets.clear()
+    levels = []
+    for scope, ident, rate, burst in limits:
+        tokens, updated = buckets.get(f"{scope}:{ident}", (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < bucket_threshold(cost, burst):
+            return scope
+        levels.append(tokens)
+    for (scope, ident, _, _), tokens in zip(limits, levels):
+        buckets[f"{scope}:{ident}"] = [tokens - cost, now]
+    return None
+
+
+async def take_shared(limits, cost: float):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for scope, ident, rate, burst in limits:
+            await token_bucket_script(
+                keys=[k_rate_limit(scope, ident)],
+                args=[cost, rate, burst],
+                client=pipe,
+            )
+        allowed = await pipe.execute()
+    for (scope, _, _, _), ok in zip(limits, allowed):
+        if not ok:
+            return scope
+    return None
+
+
+async def allow_message(room_id: str, username: str, cost: int = 1) -> bool:
+    limits = bucket_limits(room_id, username)
+    if not limits:
+        return True
+    throttled = take_local(limits, cost)
+    if throttled is None and RATE_LIMIT_BACKEND == "redis":
+        throttled = await take_shared(limits, cost)
+    if throttled is not None:
+        rate_limit_stats[f"throttled_{throttled}"] += 1
+        return False
+    rate_limit_stats["allowed"] += 1
+    return True
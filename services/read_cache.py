@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Dict
+
+from fastapi import Request, Response
+
+from services.redis_setup import pubsub_client
+from services.serialization import dumps_bytes
+
+# Rooms whose leaderboard/stats snapshots are kept per worker; 0 disables.
+READ_CACHE_ROOMS = int(os.getenv("READ_CACHE_ROOMS", "1000"))
+# Backstop for counters that change without a submission (chat, presence) and
+# for invalidations lost while the listener was reconnecting.
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "2"))
+READ_CACHE_CHANNEL = "cache:invalidate"
+
+# room_id -> {cache key: (expires_at, etag, body)}, least recently used first.
+read_cache: "OrderedDict[str, Dict[str, tuple]]" = OrderedDict()
+# Bumped on every eviction of a room with a fill in flight, so a fill that
+# raced an invalidation is never stored. Only rooms that are being loaded right
+# now have an entry, which keeps this as small as the number of open reads.
+room_versions: Dict[str, int] = {}
+fills_in_flight: Dict[str, int] = {}
+read_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+def read_cache_hit_ratio() -> float:
+    lookups = read_cache_stats["hits"] + read_cache_stats["misses"]
+    return read_cache_stats["hits"] / lookups if lookups else 0.0
+
+
+def make_etag(body: dict) -> str:
+    return '"' + hashlib.sha1(dumps_bytes(body, sort_keys=True)).hexdigest() + '"'
+
+
+def cache_channel() -> str:
+    # For the score scripts, which publish the invalidation themselves.
+    return READ_CACHE_CHANNEL if READ_CACHE_ROOMS else ""
+
+
+def evict_room(room_id: str):
+    if room_id in fills_in_flight:
+        room_versions[room_id] = room_versions.get(room_id, 0) + 1
+    if read_cache.pop(room_id, None) is not None:
+        read_cache_stats["invalidations"] += 1
+
+
+async def cached_read(room_id: str, key: str, load) -> tuple[dict, str]:
+    # Returns (body, etag), calling load() only on a miss.
+    if not READ_CACHE_ROOMS:
+        body = await load()
+        return body, make_etag(body)
+
+    now = time.monotonic()
+    entries = read_cache.get(room_id)
+    if entries is not None and key in entries:
+        expires_at, etag, body = entries[key]
+        if expires_at > now:
+            read_cache.move_to_end(room_id)
+            read_cache_stats["hits"] += 1
+            return body, etag
+
+    read_cache_stats["misses"] += 1
+    version = room_versions.get(room_id, 0)
+    fills_in_flight[room_id] = fills_in_flight.get(room_id, 0) + 1
+    try:
+        body = await load()
+    finally:
+        fills_in_flight[room_id] -= 1
+        if not fills_in_flight[room_id]:
+            del fills_in_flight[room_id]
+            changed = room_versions.pop(room_id, 0) != version
+        else:
+            changed = room_versions.get(room_id, 0) != version
+    etag = make_etag(body)
+    if not changed:
+        read_cache.setdefault(room_id, {})[key] = (now + READ_CACHE_TTL, etag, body)
+        read_cache.move_to_end(room_id)
+        while len(read_cache) > READ_CACHE_ROOMS:
+            read_cache.popitem(last=False)
+            read_cache_stats["evictions"] += 1
+    return body, etag
+
+
+def queue_cache_invalidation(pipe, room_id: str):
+    # Rides on the submission's own pipeline; the local copy goes at once so
+    # the submitting worker reads its own write.
+    evict_room(room_id)
+    if READ_CACHE_ROOMS:
+        pipe.publish(READ_CACHE_CHANNEL, room_id)
+
+
+async def read_cache_listener():
+    while READ_CACHE_ROOMS:
+        pubsub = pubsub_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(READ_CACHE_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    evict_room(message["data"])
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            print(f"Read cache listener failed: {e}")
+            # Anything could have been missed while disconnected.
+            for room_id in list(read_cache):
+                evict_room(room_id)
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+
+def etag_response(request: Request, response: Response, body: dict, etag: str):
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return body
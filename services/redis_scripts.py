@@ -0,0 +1,289 @@
+import random
+import string
+
+from helpers.keys import (
+    ROOMS_ALL,
+    k_first_solver,
+    k_leaderboard,
+    k_members,
+    k_meta,
+    k_problems,
+    k_stats,
+    k_user_rooms,
+)
+from services.legacy_keys import migrate_legacy_first_solvers
+from services.read_cache import cache_channel, evict_room
+from services.redis_setup import REDIS_CLUSTER, redis_client
+from services.room_lifecycle import ROOM_IDLE_TTL
+from services.tracing import span
+
+FIRST_SOLVER_BONUS = 10
+ROOM_ID_LENGTH = 6
+ROOM_ID_CANDIDATES = 8
+ROOM_ID_MAX_ATTEMPTS = 10
+
+# KEYS: stats hash, leaderboard zset, first-solver key, solved-problems set
+# ARGV: username, points, first-solver bonus, problem id, idle TTL (0 = none),
+#       cache invalidation channel ('' = none), room id
+SCORE_SUBMISSION_LUA = """
+redis.call('HINCRBY', KEYS[1], 'submissions', 1)
+redis.call('HINCRBY', KEYS[1], 'leaderboard_version', 1)
+local score = redis.call('ZINCRBY', KEYS[2], ARGV[2], ARGV[1])
+local bonus = 0
+if redis.call('SET', KEYS[3], ARGV[1], 'NX') then
+    score = redis.call('ZINCRBY', KEYS[2], ARGV[3], ARGV[1])
+    redis.call('SADD', KEYS[4], ARGV[4])
+    bonus = 1
+end
+if tonumber(ARGV[5]) > 0 then
+    for i = 1, 4 do
+        redis.call('EXPIRE', KEYS[i], ARGV[5])
+    end
+end
+if ARGV[6] ~= '' then
+    redis.call('PUBLISH', ARGV[6], ARGV[7])
+end
+local rank = redis.call('ZREVRANK', KEYS[2], ARGV[1])
+return {score, bonus, rank + 1}
+"""
+
+# Batch variant, one call for many submissions by the same user.
+# KEYS: stats hash, leaderboard zset, solved-problems set, then one first-solver
+#       key per submission
+# ARGV: username, first-solver bonus, idle TTL (0 = none), cache invalidation
+#       channel ('' = none), room id, then problem id + points per submission
+SCORE_SUBMISSIONS_LUA = """
+local n = #KEYS - 3
+local ttl = tonumber(ARGV[3])
+redis.call('HINCRBY', KEYS[1], 'submissions', n)
+redis.call('HINCRBY', KEYS[1], 'leaderboard_version', 1)
+local results = {}
+for i = 1, n do
+    local first_solver = KEYS[3 + i]
+    local score = redis.call('ZINCRBY', KEYS[2], ARGV[5 + 2 * i], ARGV[1])
+    local bonus = 0
+    if redis.call('SET', first_solver, ARGV[1], 'NX') then
+        score = redis.call('ZINCRBY', KEYS[2], ARGV[2], ARGV[1])
+        redis.call('SADD', KEYS[3], ARGV[4 + 2 * i])
+        bonus = 1
+    end
+    if ttl > 0 then
+        redis.call('EXPIRE', first_solver, ttl)
+    end
+    results[#results + 1] = score
+    results[#results + 1] = bonus
+    results[#results + 1] = redis.call('ZREVRANK', KEYS[2], ARGV[1]) + 1
+end
+if ttl > 0 then
+    for i = 1, 3 do
+        redis.call('EXPIRE', KEYS[i], ttl)
+    end
+end
+if ARGV[4] ~= '' then
+    redis.call('PUBLISH', ARGV[4], ARGV[5])
+end
+return results
+"""
+
+# KEYS: rooms:all, owner's user:{username}:rooms, then meta + members per candidate
+# ARGV: owner, created_at, then one room id per candidate
+CREATE_ROOM_LUA = """
+for i = 3, #ARGV do
+    local room_id = ARGV[i]
+    local meta = KEYS[2 * i - 3]
+    local members = KEYS[2 * i - 2]
+    if redis.call('EXISTS', meta) == 0
+        and redis.call('SISMEMBER', KEYS[1], room_id) == 0 then
+        redis.call('HSET', meta, 'owner', ARGV[1], 'created_at', ARGV[2])
+        redis.call('SADD', members, ARGV[1])
+        redis.call('SADD', KEYS[1], room_id)
+        redis.call('SADD', KEYS[2], room_id)
+        return room_id
+    end
+end
+return false
+"""
+
+# Cluster variant: rooms:all and the user index live on other slots, so only
+# the room's own keys are claimed atomically.
+# KEYS: room meta, room members
+# ARGV: owner, created_at
+CLAIM_ROOM_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'owner', ARGV[1], 'created_at', ARGV[2])
+redis.call('SADD', KEYS[2], ARGV[1])
+return 1
+"""
+
+# Token bucket refilled by server time, so every worker shares one clock. A
+# cost above the burst passes on a full bucket and leaves it in debt.
+# KEYS: bucket hash
+# ARGV: cost, rate, burst
+TOKEN_BUCKET_LUA = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= math.min(cost, burst) then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return allowed
+"""
+
+# One scoreboard ticker per room across all workers. Takes or renews the lease;
+# a worker that does not hold it publishes a nudge to the holder instead, in
+# the same round trip.
+# KEYS: lease key
+# ARGV: node id, lease seconds, nudge channel, room id, nudge (1 or 0)
+SCOREBOARD_LEASE_LUA = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if ARGV[5] == '1' then
+    redis.call('PUBLISH', ARGV[3], ARGV[4])
+end
+return 0
+"""
+
+# KEYS: lease key
+# ARGV: node id
+RELEASE_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+score_submission_script = redis_client.register_script(SCORE_SUBMISSION_LUA)
+score_submissions_script = redis_client.register_script(SCORE_SUBMISSIONS_LUA)
+create_room_script = redis_client.register_script(CREATE_ROOM_LUA)
+claim_room_script = redis_client.register_script(CLAIM_ROOM_LUA)
+token_bucket_script = redis_client.register_script(TOKEN_BUCKET_LUA)
+scoreboard_lease_script = redis_client.register_script(SCOREBOARD_LEASE_LUA)
+release_lease_script = redis_client.register_script(RELEASE_LEASE_LUA)
+
+
+async def load_scripts():
+    # SCRIPT LOAD once at startup so the hot path only ever sends EVALSHA.
+    for script in (
+        score_submission_script,
+        score_submissions_script,
+        create_room_script,
+        claim_room_script,
+        token_bucket_script,
+        scoreboard_lease_script,
+        release_lease_script,
+    ):
+        script.sha = await redis_client.script_load(script.script)
+
+
+async def score_submission(
+    room_id: str,
+    username: str,
+    problem_id: str,
+    points: int,
+    bonus_points: int = FIRST_SOLVER_BONUS,
+) -> tuple[float, bool, int]:
+    await migrate_legacy_first_solvers(room_id, [problem_id])
+    # HINCRBY, ZINCRBY, the first-solver SET NX and the cache invalidation
+    # PUBLISH all run inside the one script, so they share a single span.
+    with span("score_script"):
+        score, bonus, rank = await score_submission_script(
+            keys=[
+                k_stats(room_id),
+                k_leaderboard(room_id),
+                k_first_solver(room_id, problem_id),
+                k_problems(room_id),
+            ],
+            args=[
+                username,
+                points,
+                bonus_points,
+                problem_id,
+                ROOM_IDLE_TTL,
+                cache_channel(),
+                room_id,
+            ],
+        )
+    # The local copy goes at once, so this worker reads its own write.
+    evict_room(room_id)
+    return float(score), bool(bonus), int(rank)
+
+
+async def score_submissions(
+    room_id: str,
+    username: str,
+    submissions: list[tuple[str, int]],
+    bonus_points: int = FIRST_SOLVER_BONUS,
+) -> list[tuple[float, bool, int]]:
+    # Scores (problem_id, points) pairs in order, in one round trip.
+    args = [username, bonus_points, ROOM_IDLE_TTL, cache_channel(), room_id]
+    for problem_id, points in submissions:
+        args += [problem_id, points]
+    await migrate_legacy_first_solvers(room_id, [p for p, _ in submissions])
+    with span("score_script"):
+        flat = await score_submissions_script(
+            keys=[k_stats(room_id), k_leaderboard(room_id), k_problems(room_id)]
+            + [k_first_solver(room_id, problem_id) for problem_id, _ in submissions],
+            args=args,
+        )
+    evict_room(room_id)
+    return [
+        (float(score), bool(bonus), int(rank))
+        for score, bonus, rank in zip(flat[0::3], flat[1::3], flat[2::3])
+    ]
+
+
+async def create_room_record(
+    owner: str, created_at: str, length: int = ROOM_ID_LENGTH
+) -> str:
+    # Claiming an ID and registering the room happen in one atomic script, so
+    # two creators can never end up with the same room. Each call probes a
+    # batch of random candidates, which keeps creation at one round trip even
+    # when most of the keyspace is taken.
+    if REDIS_CLUSTER:
+        return await claim_room_record(owner, created_at, length)
+    for _ in range(ROOM_ID_MAX_ATTEMPTS):
+        candidates = [
+            "".join(random.choices(string.ascii_uppercase, k=length))
+            for _ in range(ROOM_ID_CANDIDATES)
+        ]
+        keys = [ROOMS_ALL, k_user_rooms(owner)]
+        for room_id in candidates:
+            keys += [k_meta(room_id), k_members(room_id)]
+        room_id = await create_room_script(
+            keys=keys, args=[owner, created_at, *candidates]
+        )
+        if room_id:
+            return room_id
+    raise RuntimeError("Could not allocate a free room id")
+
+
+async def claim_room_record(owner: str, created_at: str, length: int) -> str:
+    for _ in range(ROOM_ID_MAX_ATTEMPTS * ROOM_ID_CANDIDATES):
+        room_id = "".join(random.choices(string.ascii_uppercase, k=length))
+        claimed = await claim_room_script(
+            keys=[k_meta(room_id), k_members(room_id)], args=[owner, created_at]
+        )
+        if claimed:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.sadd(ROOMS_ALL, room_id)
+                pipe.sadd(k_user_rooms(owner), room_id)
+                await pipe.execute()
+            return room_id
+    raise RuntimeError("Could not allocate a free room id")
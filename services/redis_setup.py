@@ -1,10 +1,104 @@
 import os
+import time
+from typing import Optional
 
 import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
+from redis.asyncio.cluster import RedisCluster
+
+from services.metrics import observe_redis_command
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+REDIS_CLUSTER = os.getenv("REDIS_CLUSTER", "false").lower() in ("1", "true", "yes")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "100"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "2"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_PUBSUB_MAX_CONNECTIONS = int(os.getenv("REDIS_PUBSUB_MAX_CONNECTIONS", "16"))
+
+
+# Clients that time every command for the /metrics latency histograms. A
+# pipeline is timed as a whole, as one PIPELINE round trip.
+class TimedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            observe_redis_command("PIPELINE", started)
+
+
+class TimedRedis(redis.Redis):
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            observe_redis_command(args[0], started)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None):
+        return TimedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+class TimedRedisCluster(RedisCluster):
+    async def execute_command(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **kwargs)
+        finally:
+            observe_redis_command(args[0], started)
+
+
+def create_redis_client(
+    max_connections: int = REDIS_MAX_CONNECTIONS,
+    socket_timeout: Optional[float] = REDIS_SOCKET_TIMEOUT,
+    cluster: bool = REDIS_CLUSTER,
+):
+    if cluster:
+        return TimedRedisCluster.from_url(
+            REDIS_URL,
+            decode_responses=True,
+            max_connections=max_connections,
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        )
+    # A blocking pool makes callers wait (up to REDIS_POOL_TIMEOUT) for a free
+    # connection instead of opening new ones without limit when Redis stalls.
+    pool = redis.BlockingConnectionPool.from_url(
+        REDIS_URL,
+        decode_responses=True,
+        max_connections=max_connections,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+    )
+    return TimedRedis(connection_pool=pool)
+
+
+redis_client = create_redis_client()
+
+# Subscriber connections sit in blocking reads, so they get their own pool
+# without a socket timeout. Classic PUBLISH reaches every cluster node, so a
+# plain connection to the configured node is enough in cluster mode too.
+pubsub_client = create_redis_client(
+    REDIS_PUBSUB_MAX_CONNECTIONS, socket_timeout=None, cluster=False
+)
 
 
 async def get_redis_client():
     return redis_client
+
+
+async def close_redis_clients():
+    # The plain clients share pools they did not create, so aclose() would
+    # leave the pools' connections open; disconnect the pools directly.
+    for client in (redis_client, pubsub_client):
+        if isinstance(client, RedisCluster):
+            await client.aclose()
+        else:
+            await client.connection_pool.disconnect()
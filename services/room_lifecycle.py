@@ -0,0 +1,170 @@
+import asyncio
+import os
+import time
+from typing import Dict
+
+from helpers.keys import ROOMS_ALL, k_first_solver, k_meta, k_problems, room_keys
+from services.read_cache import queue_cache_invalidation
+from services.redis_setup import REDIS_CLUSTER, redis_client
+
+# Seconds a room may sit idle before all of its keys expire; 0 disables.
+ROOM_IDLE_TTL = int(os.getenv("ROOM_IDLE_TTL", str(7 * 24 * 3600)))
+ROOM_TTL_REFRESH_SECONDS = int(os.getenv("ROOM_TTL_REFRESH_SECONDS", "60"))
+ROOM_GC_INTERVAL = int(os.getenv("ROOM_GC_INTERVAL", "60"))
+ROOM_GC_BATCH = int(os.getenv("ROOM_GC_BATCH", "500"))
+ROOM_GC_LOCK = "gc:rooms:lock"
+
+room_touched: Dict[str, float] = {}
+gc_stats = {"sweeps": 0, "rooms_reclaimed": 0, "keys_reclaimed": 0}
+gc_cursors = {"rooms": 0, "keys": 0}
+# On a cluster every primary is scanned with its own cursor, by node name.
+gc_node_cursors: Dict[str, int] = {}
+
+
+def room_touch_due(room_id: str, force: bool = False) -> bool:
+    # Refresh the idle TTL at most once per ROOM_TTL_REFRESH_SECONDS per room.
+    if not ROOM_IDLE_TTL:
+        return False
+    now = time.monotonic()
+    if not force and now - room_touched.get(room_id, 0.0) < ROOM_TTL_REFRESH_SECONDS:
+        return False
+    if len(room_touched) > 10000:
+        room_touched.clear()
+    room_touched[room_id] = now
+    return True
+
+
+def queue_room_touch(pipe, room_id: str, force: bool = False, hot_keys=()):
+    # Rides on a pipeline the caller is already sending. hot_keys are the keys
+    # that pipeline writes, refreshed every time so they never outlive the room.
+    if not ROOM_IDLE_TTL:
+        return
+    keys = room_keys(room_id) if room_touch_due(room_id, force) else hot_keys
+    for key in keys:
+        pipe.expire(key, ROOM_IDLE_TTL)
+
+
+async def touch_room(room_id: str, force: bool = False):
+    if not room_touch_due(room_id, force):
+        return
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key in room_keys(room_id):
+            pipe.expire(key, ROOM_IDLE_TTL)
+        await pipe.execute()
+
+
+async def unlink_room(room_id: str) -> int:
+    problems = await redis_client.smembers(k_problems(room_id))
+    keys = room_keys(room_id) + [k_first_solver(room_id, p) for p in problems]
+    room_touched.pop(room_id, None)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.unlink(*keys)
+        pipe.srem(ROOMS_ALL, room_id)
+        queue_cache_invalidation(pipe, room_id)
+        unlinked, *_ = await pipe.execute()
+    return unlinked
+
+
+async def sweep_rooms_page() -> tuple[int, int]:
+    # rooms:all entries whose meta has expired or was never cleaned up.
+    cursor, room_ids = await redis_client.sscan(
+        ROOMS_ALL, cursor=gc_cursors["rooms"], count=ROOM_GC_BATCH
+    )
+    gc_cursors["rooms"] = cursor
+    room_ids = list(room_ids)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for room_id in room_ids:
+            pipe.exists(k_meta(room_id))
+        alive = await pipe.execute()
+
+    rooms = keys = 0
+    for room_id, exists in zip(room_ids, alive):
+        if not exists:
+            keys += await unlink_room(room_id)
+            rooms += 1
+    return rooms, keys
+
+
+def room_id_from_key(key: str):
+    start, end = key.find("{"), key.find("}")
+    if start == -1 or end <= start:
+        return None
+    return key[start + 1 : end]
+
+
+async def scan_keys_page(match: str) -> list[str]:
+    if not REDIS_CLUSTER:
+        cursor, keys = await redis_client.scan(
+            cursor=gc_cursors["keys"], match=match, count=ROOM_GC_BATCH
+        )
+        gc_cursors["keys"] = cursor
+        return keys
+    keys = []
+    cursors = {}
+    for node in redis_client.get_primaries():
+        node_cursors, page = await redis_client.scan(
+            cursor=gc_node_cursors.get(node.name, 0),
+            match=match,
+            count=ROOM_GC_BATCH,
+            target_nodes=node,
+        )
+        cursors[node.name] = node_cursors[node.name]
+        keys.extend(page)
+    # Rebuilt each page, so nodes that left the cluster are forgotten.
+    gc_node_cursors.clear()
+    gc_node_cursors.update(cursors)
+    return keys
+
+
+async def sweep_keys_page() -> int:
+    # Per-room and per-problem keys with no TTL whose room meta is gone, e.g.
+    # first-solver keys left behind before deletes tracked them. Keys that
+    # carry a TTL belong to live rooms and expire on their own.
+    keys = await scan_keys_page("*:{*}:*")
+    candidates = [(key, room_id_from_key(key)) for key in keys]
+    candidates = [(key, room_id) for key, room_id in candidates if room_id]
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key, room_id in candidates:
+            pipe.exists(k_meta(room_id))
+            pipe.ttl(key)
+        info = await pipe.execute()
+
+    orphans = [
+        key
+        for (key, _), exists, ttl in zip(candidates, info[0::2], info[1::2])
+        if not exists and ttl == -1
+    ]
+    if not orphans:
+        return 0
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key in orphans:
+            pipe.unlink(key)
+        return sum(await pipe.execute())
+
+
+async def sweep_once() -> tuple[int, int]:
+    rooms, keys = await sweep_rooms_page()
+    # Without an idle TTL no key carries one, so "no TTL" says nothing about a
+    # key being orphaned; meta-less websocket rooms would be swept.
+    if ROOM_IDLE_TTL:
+        keys += await sweep_keys_page()
+    gc_stats["sweeps"] += 1
+    gc_stats["rooms_reclaimed"] += rooms
+    gc_stats["keys_reclaimed"] += keys
+    if rooms or keys:
+        print(f"Room GC reclaimed {rooms} rooms and {keys} keys.")
+    return rooms, keys
+
+
+async def room_gc_worker():
+    # One page of each scan per interval; the lock keeps a single worker per
+    # deployment sweeping at a time.
+    while True:
+        try:
+            await asyncio.sleep(ROOM_GC_INTERVAL)
+            if await redis_client.set(ROOM_GC_LOCK, "1", nx=True, ex=ROOM_GC_INTERVAL):
+                await sweep_once()
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            print(f"Room GC failed: {e}")
@@ -0,0 +1,218 @@
+import asyncio
+import os
+from typing import Dict, Optional
+
+from helpers.keys import k_scoreboard_lease
+from helpers.redis import get_leaderboard
+from services.metrics import count_error
+from services.node_registry import NODE_ID
+from services.redis_scripts import release_lease_script, scoreboard_lease_script
+from services.redis_setup import pubsub_client
+from services.tracing import span, traced
+from services.websocket_pubsub import iso_now, publish_room_event
+
+SCOREBOARD_WINDOW_MS = int(os.getenv("SCOREBOARD_WINDOW_MS", "100"))
+SCOREBOARD_KEYFRAME_SECONDS = float(os.getenv("SCOREBOARD_KEYFRAME_SECONDS", "5"))
+SCOREBOARD_TOP_N = 50
+# Every worker with sockets in a room runs a ticker, but only the one holding
+# room:{id}:ticker broadcasts deltas, so clients don't get one copy per
+# worker. The others send join keyframes and nudge the holder over
+# SCOREBOARD_NUDGE_CHANNEL when their own sockets submit.
+SCOREBOARD_LEASE_SECONDS = float(os.getenv("SCOREBOARD_LEASE_SECONDS", "15"))
+SCOREBOARD_NUDGE_CHANNEL = "scoreboard:nudge"
+
+scoreboard_tasks: Dict[str, asyncio.Task] = {}
+scoreboard_dirty: Dict[str, asyncio.Event] = {}
+keyframe_requested: set[str] = set()
+# Rooms whose ticker lease this worker holds.
+leased_rooms: set[str] = set()
+
+
+def mark_scoreboard_dirty(room_id: str):
+    scoreboard_dirty.setdefault(room_id, asyncio.Event()).set()
+
+
+def request_scoreboard_keyframe(room_id: str):
+    keyframe_requested.add(room_id)
+    mark_scoreboard_dirty(room_id)
+
+
+def diff_leaderboard(previous: list[dict], current: list[dict]):
+    before = {
+        row["username"]: (rank, row["score"])
+        for rank, row in enumerate(previous, start=1)
+    }
+    changes = [
+        {"username": row["username"], "score": row["score"], "rank": rank}
+        for rank, row in enumerate(current, start=1)
+        if before.get(row["username"]) != (rank, row["score"])
+    ]
+    current_users = {row["username"] for row in current}
+    removed = [username for username in before if username not in current_users]
+    return changes, removed
+
+
+async def scoreboard_tick(
+    room_id: str, previous: list[dict], keyframe_due: bool
+) -> Optional[list[dict]]:
+    # One leaderboard read and at most one broadcast. Returns what was read,
+    # or None if the read failed.
+    try:
+        with span("leaderboard_read"):
+            current = await get_leaderboard(room_id, top_n=SCOREBOARD_TOP_N)
+    except Exception:
+        count_error("scoreboard_read")
+        return None
+
+    if keyframe_due:
+        keyframe_requested.discard(room_id)
+        event = {
+            "type": "system",
+            "action": "scoreboard_update",
+            "leaderboard": current,
+            "timestamp": iso_now(),
+        }
+    else:
+        changes, removed = diff_leaderboard(previous, current)
+        if not changes and not removed:
+            return current
+        # Deltas accumulate drift for anyone who missed one, so make sure a
+        # keyframe follows once the interval has passed.
+        keyframe_requested.add(room_id)
+        event = {
+            "type": "system",
+            "action": "scoreboard_delta",
+            "changes": changes,
+            "removed": removed,
+            "timestamp": iso_now(),
+        }
+
+    try:
+        await publish_room_event(room_id, event)
+    except Exception:
+        count_error("scoreboard_publish")
+    return current
+
+
+async def claim_scoreboard_lease(room_id: str, nudge: bool) -> bool:
+    try:
+        held = await scoreboard_lease_script(
+            keys=[k_scoreboard_lease(room_id)],
+            args=[
+                NODE_ID,
+                int(SCOREBOARD_LEASE_SECONDS),
+                SCOREBOARD_NUDGE_CHANNEL,
+                room_id,
+                int(nudge),
+            ],
+        )
+    except Exception:
+        # Without Redis to decide, broadcasting twice beats going quiet.
+        count_error("scoreboard_lease")
+        held = True
+    if held:
+        leased_rooms.add(room_id)
+    else:
+        leased_rooms.discard(room_id)
+    return bool(held)
+
+
+async def release_scoreboard_lease(room_id: str):
+    if room_id not in leased_rooms:
+        return
+    leased_rooms.discard(room_id)
+    try:
+        await release_lease_script(keys=[k_scoreboard_lease(room_id)], args=[NODE_ID])
+    except Exception:
+        count_error("scoreboard_lease")
+
+
+async def scoreboard_ticker(room_id: str):
+    # Submissions only mark the room dirty; this task turns everything that
+    # arrives within one window into a single delta broadcast, and sends a
+    # full keyframe at most once per SCOREBOARD_KEYFRAME_SECONDS.
+    dirty = scoreboard_dirty.setdefault(room_id, asyncio.Event())
+    loop = asyncio.get_running_loop()
+    previous: list[dict] = []
+    last_keyframe = float("-inf")
+    leader = False
+    lease_checked = float("-inf")
+    # Wake up often enough to renew the lease while the room is quiet.
+    idle_wait = min(SCOREBOARD_KEYFRAME_SECONDS, SCOREBOARD_LEASE_SECONDS / 3)
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(dirty.wait(), idle_wait)
+            except asyncio.TimeoutError:
+                pass
+
+            # Before 3.12, wait_for can swallow a cancel that lands as the
+            # Event fires; a ticker that is no longer registered stops itself.
+            if scoreboard_tasks.get(room_id) is not asyncio.current_task():
+                break
+
+            was_dirty = dirty.is_set()
+            if was_dirty:
+                await asyncio.sleep(SCOREBOARD_WINDOW_MS / 1000)
+            dirty.clear()
+
+            renew_due = loop.time() - lease_checked >= SCOREBOARD_LEASE_SECONDS / 3
+            if renew_due or (was_dirty and not leader):
+                leader = await claim_scoreboard_lease(room_id, nudge=was_dirty)
+                lease_checked = loop.time()
+
+            keyframe_due = (
+                room_id in keyframe_requested
+                and loop.time() - last_keyframe >= SCOREBOARD_KEYFRAME_SECONDS
+            )
+            if not keyframe_due and not (was_dirty and leader):
+                continue
+
+            with traced(room_id, "scoreboard"):
+                current = await scoreboard_tick(room_id, previous, keyframe_due)
+            if current is None:
+                continue
+            if keyframe_due:
+                last_keyframe = loop.time()
+            previous = current
+    except asyncio.CancelledError:
+        pass
+    finally:
+        # A socket may have rejoined the room before this task unwound; its
+        # ticker then shares the Event and the pending keyframe request.
+        successor = scoreboard_tasks.get(room_id)
+        if scoreboard_dirty.get(room_id) is dirty and successor in (
+            None,
+            asyncio.current_task(),
+        ):
+            scoreboard_dirty.pop(room_id, None)
+            keyframe_requested.discard(room_id)
+        if successor is None:
+            await release_scoreboard_lease(room_id)
+
+
+async def scoreboard_listener():
+    # Nudges from workers that saw submissions in a room this worker leads.
+    while True:
+        pubsub = pubsub_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(SCOREBOARD_NUDGE_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message" and message["data"] in leased_rooms:
+                    mark_scoreboard_dirty(message["data"])
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            count_error("scoreboard_listener")
+            print(f"Scoreboard listener failed: {e}")
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+
+async def stop_scoreboard_tickers():
+    tasks = list(scoreboard_tasks.values())
+    scoreboard_tasks.clear()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
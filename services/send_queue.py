@@ -0,0 +1,172 @@
+import asyncio
+import os
+from collections import deque
+from typing import Optional
+
+from fastapi import WebSocket
+
+from services.serialization import dumps
+from services.wire_format import JSON, Frame
+
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "256"))
+# drop_oldest | disconnect | coalesce
+SLOW_CONSUMER_POLICY = os.getenv("SLOW_CONSUMER_POLICY", "drop_oldest")
+
+# Frame kinds. A keyframe carries the whole board; a delta only makes sense
+# on top of every frame before it.
+SCOREBOARD_KEYFRAME = "scoreboard_update"
+SCOREBOARD_DELTA = "scoreboard_delta"
+SCOREBOARD_KINDS = (SCOREBOARD_KEYFRAME, SCOREBOARD_DELTA)
+SCOREBOARD_MARKERS = {kind: dumps({"action": kind})[1:-1] for kind in SCOREBOARD_KINDS}
+
+send_stats = {"dropped": 0, "disconnected": 0, "send_failures": 0}
+
+
+def frame_kind(payload: str) -> Optional[str]:
+    # Tags an event once, from the JSON as published, before it is encoded for
+    # any wire format. Quotes inside string values are escaped, so chat text
+    # can't match the action marker.
+    for kind, marker in SCOREBOARD_MARKERS.items():
+        if marker in payload:
+            return kind
+    return None
+
+
+def stream_id_key(event_id: str) -> tuple[int, int]:
+    ms, _, seq = event_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+# Bounded outbound buffer for one socket, drained by its own writer task so a
+# slow client never blocks the broadcaster.
+class ClientQueue:
+    def __init__(
+        self,
+        websocket: WebSocket,
+        maxsize: int = SEND_QUEUE_SIZE,
+        policy: str = SLOW_CONSUMER_POLICY,
+        wire_format: str = JSON,
+    ):
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.wire_format = wire_format
+        # (frame, kind from frame_kind)
+        self.pending: deque[tuple[Frame, Optional[str]]] = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+        # Coalesce: set once a scoreboard frame was dropped. Later deltas would
+        # patch a board the client doesn't have, so they are skipped until the
+        # next keyframe, which the ticker sends after any delta.
+        self.awaiting_keyframe = False
+        # True while the writer has popped a frame and is still sending it.
+        self.sending = False
+        # Stream resume state: last event id delivered, and live events held
+        # back while a replay is in flight.
+        self.last_id: Optional[str] = None
+        self.held: Optional[list[tuple[str, Frame, Optional[str]]]] = None
+        self.writer = asyncio.create_task(self.drain())
+
+    def put(self, payload: Frame, kind: Optional[str] = None) -> bool:
+        # Returns False when the client should be disconnected.
+        if self.closed:
+            return False
+        if self.awaiting_keyframe:
+            if kind == SCOREBOARD_DELTA:
+                self.count_dropped(1)
+                return True
+            if kind == SCOREBOARD_KEYFRAME:
+                self.awaiting_keyframe = False
+        if len(self.pending) >= self.maxsize:
+            if self.policy == "disconnect":
+                send_stats["disconnected"] += 1
+                return False
+            if self.policy == "coalesce":
+                if kind == SCOREBOARD_KEYFRAME:
+                    # Supersedes every queued scoreboard frame.
+                    self.drop_scoreboard_frames()
+                elif self.pending[0][1] in SCOREBOARD_KINDS:
+                    # Never drop just one scoreboard frame: drop them all and
+                    # wait for a keyframe to replace them.
+                    self.drop_scoreboard_frames()
+                    self.awaiting_keyframe = True
+                    if kind == SCOREBOARD_DELTA:
+                        self.count_dropped(1)
+                        return True
+            if len(self.pending) >= self.maxsize:
+                self.pending.popleft()
+                self.count_dropped(1)
+        self.pending.append((payload, kind))
+        self.ready.set()
+        return True
+
+    def count_dropped(self, count: int):
+        send_stats["dropped"] += count
+        self.dropped += count
+
+    def drop_scoreboard_frames(self):
+        kept = [item for item in self.pending if item[1] not in SCOREBOARD_KINDS]
+        self.count_dropped(len(self.pending) - len(kept))
+        self.pending = deque(kept)
+
+    def put_event(
+        self, event_id: str, payload: Frame, kind: Optional[str] = None
+    ) -> bool:
+        # payload is already encoded for this queue's format, id included.
+        if self.held is not None:
+            self.held.append((event_id, payload, kind))
+            return True
+        if self.last_id is not None:
+            try:
+                if stream_id_key(event_id) <= stream_id_key(self.last_id):
+                    return True
+            except ValueError:
+                pass
+        self.last_id = event_id
+        return self.put(payload, kind)
+
+    def finish_replay(
+        self,
+        entries: list[tuple[str, Frame, Optional[str]]],
+        truncated: bool,
+        marker: Frame,
+    ) -> bool:
+        # marker goes out last when the replay was cut short, or when the queue
+        # had to drop frames to fit it, so the client knows it missed events.
+        held, self.held = self.held or [], None
+        dropped = self.dropped
+        ok = True
+        for event_id, payload, kind in entries + held:
+            ok = self.put_event(event_id, payload, kind) and ok
+        if ok and (truncated or self.dropped > dropped):
+            ok = self.put(marker)
+        return ok
+
+    async def drain(self):
+        try:
+            while True:
+                while not self.pending:
+                    self.ready.clear()
+                    await self.ready.wait()
+                frame, _ = self.pending.popleft()
+                self.sending = True
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                self.sending = False
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            send_stats["send_failures"] += 1
+            self.closed = True
+            self.pending.clear()
+
+    def idle(self) -> bool:
+        return not self.pending and not self.sending
+
+    def close(self):
+        self.closed = True
+        self.pending.clear()
+        self.writer.cancel()
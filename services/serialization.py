@@ -0,0 +1,36 @@
+import json
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is the fallback.
+    orjson = None
+
+# Every event, history entry and REST body is encoded here, once. Both
+# encoders emit the same compact form, so payloads look alike whichever one
+# produced them.
+
+
+def dumps(obj) -> str:
+    if orjson:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def dumps_bytes(obj, sort_keys: bool = False) -> bytes:
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys).encode()
+
+
+def loads(data):
+    # Raises ValueError (JSONDecodeError is a subclass for both) on bad input.
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps_bytes(content)
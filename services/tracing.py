@@ -0,0 +1,143 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+from helpers.keys import SLOW_TRACES, TRACED_ROOMS
+from services.metrics import count_error
+from services.redis_setup import redis_client
+from services.serialization import dumps, loads
+
+# Fraction of websocket messages and scoreboard ticks traced; 0 turns sampling
+# off. Rooms switched on at runtime through /debug/traces are always traced and
+# keep every trace, not just the slow ones.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "50"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+TRACE_ROOM_TTL_SECONDS = int(os.getenv("TRACE_ROOM_TTL_SECONDS", "3600"))
+TRACE_SYNC_SECONDS = 1.0
+
+# The switch and the buffer are shared by every worker through Redis: traced
+# rooms are a ZSET scored by expiry time, and slow traces a list capped at
+# TRACE_BUFFER_SIZE. Each worker keeps a local copy of the traced rooms for the
+# hot path and queues its traces locally, syncing both every TRACE_SYNC_SECONDS.
+traced_rooms: set[str] = set()
+slow_traces: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+class Trace:
+    __slots__ = ("room_id", "kind", "started", "started_at", "spans")
+
+    def __init__(self, room_id: str, kind: str):
+        self.room_id = room_id
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.spans: list[tuple[str, float, float]] = []
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def ms_since(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 3)
+
+
+@contextmanager
+def traced(room_id: str, kind: str):
+    # Starts a trace for one unit of work if it is sampled; spans opened
+    # anywhere below, including other modules, attach to it.
+    sampled = room_id in traced_rooms or (
+        TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    )
+    if not sampled:
+        yield None
+        return
+    trace = Trace(room_id, kind)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        total_ms = ms_since(trace.started)
+        if total_ms >= TRACE_SLOW_MS or room_id in traced_rooms:
+            slow_traces.append(
+                {
+                    "room_id": trace.room_id,
+                    "kind": trace.kind,
+                    "started_at": trace.started_at,
+                    "total_ms": total_ms,
+                    "spans": [
+                        {"name": name, "offset_ms": offset, "ms": duration}
+                        for name, offset, duration in trace.spans
+                    ],
+                }
+            )
+
+
+def set_trace_kind(kind: str):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.kind = kind
+
+
+@contextmanager
+def span(name: str):
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        offset = round((start - trace.started) * 1000, 3)
+        trace.spans.append((name, offset, ms_since(start)))
+
+
+async def trace_room(room_id: str):
+    await redis_client.zadd(
+        TRACED_ROOMS, {room_id: time.time() + TRACE_ROOM_TTL_SECONDS}
+    )
+    traced_rooms.add(room_id)
+
+
+async def untrace_room(room_id: str):
+    await redis_client.zrem(TRACED_ROOMS, room_id)
+    traced_rooms.discard(room_id)
+
+
+async def recent_traces(room_id: Optional[str] = None, limit: int = 50) -> list[dict]:
+    traces = [loads(t) for t in await redis_client.lrange(SLOW_TRACES, 0, -1)]
+    return [t for t in traces if room_id in (None, t["room_id"])][:limit]
+
+
+async def sync_traces():
+    pending = list(slow_traces)
+    slow_traces.clear()
+    async with redis_client.pipeline(transaction=False) as pipe:
+        if pending:
+            pipe.lpush(SLOW_TRACES, *[dumps(t) for t in pending])
+            pipe.ltrim(SLOW_TRACES, 0, TRACE_BUFFER_SIZE - 1)
+        pipe.zremrangebyscore(TRACED_ROOMS, "-inf", time.time())
+        pipe.zrange(TRACED_ROOMS, 0, -1)
+        results = await pipe.execute()
+    traced_rooms.clear()
+    traced_rooms.update(results[-1])
+
+
+async def trace_worker():
+    while True:
+        try:
+            await asyncio.sleep(TRACE_SYNC_SECONDS)
+            await sync_traces()
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            count_error("trace_worker")
+            print(f"Trace sync failed: {e}")
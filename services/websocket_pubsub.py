@@ -1,68 +1,352 @@
 import asyncio
-import json
+import os
+import time
+import zlib
 from datetime import datetime, timezone
-from typing import Dict
+from typing import Dict, Optional
 
-from fastapi import WebSocket
+from fastapi import WebSocket, status
+from redis.asyncio.client import PubSub
+from redis.crc import key_slot
 
-from services.redis_setup import redis_client
+from helpers.keys import k_event_channel, k_history, k_stats, k_stream
+from services.metrics import count_error, fan_out_seconds
+from services.redis_setup import REDIS_CLUSTER, pubsub_client, redis_client
+from services.room_lifecycle import queue_room_touch
+from services.send_queue import ClientQueue, frame_kind
+from services.serialization import dumps
+from services.tracing import span
+from services.wire_format import JSON, Frame, encode_frame
+
+MAX_HISTORY = int(os.getenv("MAX_HISTORY", "100"))
+
+PUBSUB_POOL_SIZE = int(os.getenv("PUBSUB_POOL_SIZE", "1"))
+
+# pubsub | streams
+EVENT_BACKEND = os.getenv("EVENT_BACKEND", "pubsub")
+STREAM_MAXLEN = int(os.getenv("STREAM_MAXLEN", "1000"))
+STREAM_BLOCK_MS = int(os.getenv("STREAM_BLOCK_MS", "1000"))
+# Redis Cluster only: XREAD can't span hash slots, so the streams are polled,
+# one non-blocking XREAD per slot in a single pipeline, every STREAM_POLL_MS
+# while nothing arrives.
+STREAM_POLL_MS = int(os.getenv("STREAM_POLL_MS", "50"))
 
 connected: Dict[str, set[WebSocket]] = {}
-pubsub_tasks: Dict[str, asyncio.Task] = {}
+send_queues: Dict[WebSocket, ClientQueue] = {}
+pubsub_shards: Dict[int, PubSub] = {}
+pubsub_readers: Dict[int, asyncio.Task] = {}
+subscribed_channels: Dict[str, str] = {}
+pubsub_lock = asyncio.Lock()
+stream_rooms: Dict[str, str] = {}
+stream_offsets: Dict[str, str] = {}
+stream_wakeup = asyncio.Event()
+stream_reader_task: Optional[asyncio.Task] = None
 
 
-def k_users(room_id: str) -> str:
-    return f"room:{room_id}:users"
+def iso_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
 
 
-def k_event_channel(room_id: str) -> str:
-    return f"room:{room_id}:events"
+def queue_room_event(pipe, room_id: str, event: dict, history_max: int = MAX_HISTORY):
+    payload = dumps(event)
+    if EVENT_BACKEND == "streams":
+        pipe.xadd(
+            k_stream(room_id),
+            {"data": payload},
+            maxlen=STREAM_MAXLEN,
+            approximate=True,
+        )
+    else:
+        pipe.publish(k_event_channel(room_id), payload)
+        pipe.lpush(k_history(room_id), payload)
+        pipe.ltrim(k_history(room_id), 0, history_max - 1)
+    pipe.hincrby(k_stats(room_id), "message_sent", 1)
+    return payload
 
 
-def k_stats(room_id: str) -> str:
-    return f"room:{room_id}:stats"
+async def publish_room_events(
+    room_id: str,
+    events: list[dict],
+    history_max: int = MAX_HISTORY,
+    stats: Optional[Dict[str, int]] = None,
+    force_touch: bool = False,
+):
+    # PUBLISH + LPUSH + LTRIM (or one XADD) + HINCRBY for every event, plus any
+    # extra stats counters, in a single round trip.
+    async with redis_client.pipeline(transaction=False) as pipe:
+        with span("publish_encode"):
+            for field, amount in (stats or {}).items():
+                pipe.hincrby(k_stats(room_id), field, amount)
+            for event in events:
+                queue_room_event(pipe, room_id, event, history_max)
+            log_key = (
+                k_stream(room_id) if EVENT_BACKEND == "streams" else k_history(room_id)
+            )
+            queue_room_touch(
+                pipe, room_id, force=force_touch, hot_keys=(k_stats(room_id), log_key)
+            )
+        with span("publish_redis"):
+            await pipe.execute()
 
 
-def k_history(room_id: str) -> str:
-    return f"room:{room_id}:history"
+async def publish_room_event(
+    room_id: str,
+    event: dict,
+    history_max: int = MAX_HISTORY,
+    stats: Optional[Dict[str, int]] = None,
+    force_touch: bool = False,
+):
+    await publish_room_events(room_id, [event], history_max, stats, force_touch)
 
 
-def iso_now() -> str:
-    return datetime.now(timezone.utc).isoformat()
+def pubsub_shard(room_id: str) -> int:
+    return zlib.crc32(room_id.encode()) % PUBSUB_POOL_SIZE
 
 
-async def publish_room_event(room_id: str, event: dict, history_max: int = 100):
-    payload = json.dumps(event)
-    await redis_client.publish(k_event_channel(room_id), payload)
-    await redis_client.lpush(k_history(room_id), payload)
-    await redis_client.ltrim(k_history(room_id), 0, history_max - 1)
-    await redis_client.hincrby(k_stats(room_id), "message_sent", 1)
+async def subscribe_room(room_id: str):
+    if EVENT_BACKEND == "streams":
+        return await subscribe_room_stream(room_id)
+    channel = k_event_channel(room_id)
+    async with pubsub_lock:
+        if channel in subscribed_channels:
+            return
+        shard = pubsub_shard(room_id)
+        pubsub = pubsub_shards.get(shard)
+        if pubsub is None:
+            pubsub = pubsub_shards[shard] = pubsub_client.pubsub()
+        await pubsub.subscribe(channel)
+        subscribed_channels[channel] = room_id
+        if shard not in pubsub_readers:
+            pubsub_readers[shard] = asyncio.create_task(pubsub_reader(pubsub))
 
 
-async def room_pubsub_worker(room_id: str):
+async def unsubscribe_room(room_id: str):
+    if EVENT_BACKEND == "streams":
+        return unsubscribe_room_stream(room_id)
     channel = k_event_channel(room_id)
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe(channel)
+    async with pubsub_lock:
+        # The caller saw the room empty, but a socket may have joined while we
+        # waited for the lock; it found the channel subscribed and skipped.
+        if connected.get(room_id) or subscribed_channels.pop(channel, None) is None:
+            return
+        try:
+            await pubsub_shards[pubsub_shard(room_id)].unsubscribe(channel)
+        except Exception:
+            count_error("pubsub_unsubscribe")
+
+
+async def subscribe_room_stream(room_id: str):
+    global stream_reader_task
+    key = k_stream(room_id)
+    if key in stream_rooms:
+        return
+    stream_rooms[key] = room_id
+    # Start from the current tail; anything older is served by replay.
+    latest = await redis_client.xrevrange(key, count=1)
+    if stream_rooms.get(key) != room_id:
+        return
+    stream_offsets[key] = latest[0][0] if latest else "0-0"
+    stream_wakeup.set()
+    if stream_reader_task is None or stream_reader_task.done():
+        stream_reader_task = asyncio.create_task(stream_reader())
+
+
+def unsubscribe_room_stream(room_id: str):
+    if connected.get(room_id):
+        return
+    key = k_stream(room_id)
+    stream_rooms.pop(key, None)
+    stream_offsets.pop(key, None)
+
+
+def register_client(
+    room_id: str,
+    websocket: WebSocket,
+    last_event_id: Optional[str] = None,
+    wire_format: str = JSON,
+):
+    connected.setdefault(room_id, set()).add(websocket)
+    queue = send_queues[websocket] = ClientQueue(websocket, wire_format=wire_format)
+    if EVENT_BACKEND == "streams" and last_event_id:
+        # Hold live events until replay_room_events has caught the client up.
+        queue.last_id = last_event_id
+        queue.held = []
+
+
+async def replay_room_events(room_id: str, websocket: WebSocket):
+    queue = send_queues.get(websocket)
+    if queue is None or queue.held is None:
+        return
+    requested = queue.last_id
+    entries = []
+    truncated = False
     try:
-        async for message in pubsub.listen():
-            if not message:
-                continue
-            if message.get("type") != "message":
+        # Newest first, and no more than the send queue holds: a longer gap
+        # could only be delivered by dropping part of it.
+        entries = await redis_client.xrevrange(
+            k_stream(room_id),
+            max="+",
+            min=f"({requested}",
+            count=queue.maxsize + 1,
+        )
+        truncated = len(entries) > queue.maxsize
+        entries = entries[: queue.maxsize][::-1]
+    except Exception:
+        count_error("stream_replay")
+    finally:
+        marker = {
+            "type": "system",
+            "action": "replay_truncated",
+            "last_event_id": requested,
+            "timestamp": iso_now(),
+        }
+        ok = queue.finish_replay(
+            [
+                (
+                    entry_id,
+                    encode_frame(fields["data"], queue.wire_format, entry_id),
+                    frame_kind(fields["data"]),
+                )
+                for entry_id, fields in entries
+            ],
+            truncated,
+            encode_frame(dumps(marker), queue.wire_format),
+        )
+    if not ok:
+        queue.close()
+        await close_slow_consumer(websocket)
+
+
+def unregister_client(room_id: str, websocket: WebSocket) -> bool:
+    # Returns True when this was the room's last local client.
+    queue = send_queues.pop(websocket, None)
+    if queue:
+        queue.close()
+    clients = connected.get(room_id)
+    if clients is not None:
+        clients.discard(websocket)
+        if clients:
+            return False
+        connected.pop(room_id, None)
+    return True
+
+
+async def close_slow_consumer(websocket: WebSocket):
+    try:
+        await websocket.close(
+            code=status.WS_1013_TRY_AGAIN_LATER, reason="client too slow"
+        )
+    except Exception:
+        count_error("slow_consumer_close")
+
+
+def fan_out(room_id: str, payload: str, event_id: Optional[str] = None):
+    # Only enqueues; each client's writer task does the network I/O. Each
+    # wire format is encoded once per event, however many sockets use it.
+    started = time.perf_counter()
+    kind = frame_kind(payload)
+    frames: Dict[str, Frame] = {}
+    for ws in list(connected.get(room_id, ())):
+        queue = send_queues.get(ws)
+        if queue is None:
+            continue
+        frame = frames.get(queue.wire_format)
+        if frame is None:
+            frame = frames[queue.wire_format] = encode_frame(
+                payload, queue.wire_format, event_id
+            )
+        if event_id is None:
+            ok = queue.put(frame, kind)
+        else:
+            ok = queue.put_event(event_id, frame, kind)
+        if not ok:
+            queue.close()
+            asyncio.create_task(close_slow_consumer(ws))
+    fan_out_seconds.observe(time.perf_counter() - started)
+
+
+async def pubsub_reader(pubsub: PubSub):
+    # One reader per shared connection; messages are routed to the room's
+    # local sockets by channel name.
+    while True:
+        try:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=1.0
+            )
+        except asyncio.CancelledError:
+            break
+        except Exception:
+            count_error("pubsub_reader")
+            await asyncio.sleep(1.0)
+            continue
+        if not message or message.get("type") != "message":
+            continue
+        room_id = subscribed_channels.get(message.get("channel"))
+        payload = message.get("data")
+        if room_id is None or not payload:
+            continue
+        fan_out(room_id, payload)
+
+
+async def read_streams(offsets: Dict[str, str]) -> list:
+    if not REDIS_CLUSTER:
+        return await redis_client.xread(offsets, count=100, block=STREAM_BLOCK_MS)
+    slots: Dict[int, Dict[str, str]] = {}
+    for key, offset in offsets.items():
+        slots.setdefault(key_slot(key.encode()), {})[key] = offset
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for streams in slots.values():
+            pipe.xread(streams, count=100)
+        responses = await pipe.execute()
+    response = [item for slot_response in responses for item in slot_response or []]
+    if not response:
+        await asyncio.sleep(STREAM_POLL_MS / 1000)
+    return response
+
+
+async def stream_reader():
+    # One blocking XREAD across every locally subscribed room stream, or one
+    # polled XREAD per slot on a cluster.
+    while True:
+        try:
+            if not stream_offsets:
+                stream_wakeup.clear()
+                await stream_wakeup.wait()
                 continue
-            payload = message.get("data")
-            if not payload:
+            response = await read_streams(dict(stream_offsets))
+        except asyncio.CancelledError:
+            break
+        except Exception:
+            count_error("stream_reader")
+            await asyncio.sleep(1.0)
+            continue
+        for key, entries in response or []:
+            room_id = stream_rooms.get(key)
+            if room_id is None or key not in stream_offsets:
                 continue
-            clients = list(connected.get(room_id, set()))
-            for ws in clients:
-                try:
-                    await ws.send_text(payload)
-                except Exception:
-                    pass
-    except asyncio.CancelledError:
-        pass
-    finally:
+            for entry_id, fields in entries:
+                stream_offsets[key] = entry_id
+                fan_out(room_id, fields["data"], event_id=entry_id)
+
+
+async def stop_event_readers():
+    # Shutdown: stop the pub/sub and stream readers and give their connections
+    # back, so the pools can close cleanly.
+    global stream_reader_task
+    tasks = list(pubsub_readers.values())
+    if stream_reader_task is not None:
+        tasks.append(stream_reader_task)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for pubsub in pubsub_shards.values():
         try:
-            await pubsub.unsubscribe(channel)
-            await pubsub.close()
+            await pubsub.aclose()
         except Exception:
-            pass
+            count_error("pubsub_close")
+    pubsub_readers.clear()
+    pubsub_shards.clear()
+    subscribed_channels.clear()
+    stream_rooms.clear()
+    stream_offsets.clear()
+    stream_reader_task = None
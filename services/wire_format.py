@@ -0,0 +1,94 @@
+from typing import Optional, Union
+
+from fastapi import WebSocket
+
+from services.serialization import dumps, loads
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; without it only JSON is offered.
+    msgpack = None
+
+# Wire formats for /ws/{room_id}, negotiated through Sec-WebSocket-Protocol.
+# JSON text frames stay the default for clients that ask for nothing.
+JSON = "json"
+MSGPACK = "msgpack"
+SUPPORTED_FORMATS = (MSGPACK,) if msgpack else ()
+
+# msgpack frames shorten the field names; values are unchanged.
+FIELD_CODES = {
+    "id": "i",
+    "type": "t",
+    "action": "a",
+    "username": "u",
+    "message": "m",
+    "timestamp": "ts",
+    "problem_id": "p",
+    "points": "pt",
+    "new_score": "ns",
+    "bonus_awarded": "b",
+    "rank": "r",
+    "score": "s",
+    "changes": "c",
+    "removed": "x",
+    "leaderboard": "l",
+    "room_id": "rm",
+    "error": "e",
+}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+
+Frame = Union[str, bytes]
+
+
+def negotiate_format(websocket: WebSocket) -> str:
+    for requested in websocket.scope.get("subprotocols", []):
+        if requested in SUPPORTED_FORMATS:
+            return requested
+    return JSON
+
+
+def rename_fields(value, names: dict):
+    if isinstance(value, dict):
+        return {names.get(k, k): rename_fields(v, names) for k, v in value.items()}
+    if isinstance(value, list):
+        return [rename_fields(v, names) for v in value]
+    return value
+
+
+def encode_frame(
+    payload: str, wire_format: str, event_id: Optional[str] = None
+) -> Frame:
+    # payload is the JSON event as published; event_id is spliced in first.
+    if wire_format == MSGPACK:
+        event = loads(payload)
+        if event_id is not None:
+            event = {"id": event_id, **event}
+        return msgpack.packb(rename_fields(event, FIELD_CODES))
+    if event_id is not None:
+        return f'{{"id":"{event_id}",{payload[1:]}'
+    return payload
+
+
+def decode_frame(message: dict, wire_format: str) -> dict:
+    # message is what WebSocket.receive() returned; raises ValueError on junk.
+    if message.get("bytes") is not None:
+        if wire_format != MSGPACK:
+            raise ValueError("binary frames need the msgpack subprotocol")
+        try:
+            data = msgpack.unpackb(message["bytes"])
+        except Exception as e:
+            raise ValueError(str(e))
+        data = rename_fields(data, FIELD_NAMES)
+    else:
+        data = loads(message.get("text") or "")
+    if not isinstance(data, dict):
+        raise ValueError("expected an object")
+    return data
+
+
+async def send_message(websocket: WebSocket, wire_format: str, message: dict):
+    frame = encode_frame(dumps(message), wire_format)
+    if isinstance(frame, bytes):
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
@@ -0,0 +1,5 @@
+from dotenv import load_dotenv
+
+# Every module reads its settings from os.environ when it is imported, so this
+# must be imported before anything else.
+load_dotenv()